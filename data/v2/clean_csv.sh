@@ -1,4 +1,2 @@
-sed -i '/,,,,/d' download_data_raw.csv
-sed -i '/\/dependabot\//d' download_data_raw.csv
-sed -i '/\/pull\//d' download_data_raw.csv
-python remove_duplicates.py
\ No newline at end of file
+# removes empty rows, dependabot and pull request branches, and duplicate releases from `download_data_raw.csv`
+python remove_duplicates.py --input_file download_data_raw.csv --output_file download_data_cleaned.csv
@@ -1,38 +1,35 @@
-import re
+import argparse
 
 import pandas as pd
 
+# first component of the branch (split on '/') that contains a version, e.g., `refs/tags/v1.2.0` -> `v1.2.0`
+VERSION_REGEX = r'(?:^|/)([^/]*?\d+\.\d+[^/]*)'
+# rows of branches that are not releases
+EXCLUDED_PATTERNS = ('/dependabot/', '/pull/')
 
-def extract_version(branch_string):
-    parts = branch_string.split('/')
-    for part in parts:
-        match = re.search(r'(v?\d+\.\d+(\.\d+)*)', part)
-        if match:
-            return part
-    return None
 
+def clean_releases(df):
+    """
+    Removes the rows without branch data, the dependabot and pull request branches, and the duplicate releases
+    (same version) of each repository, keeping the first occurrence.
+    """
+    # rows written without branch data (`,,,,`)
+    keep = ~(df[['branch', 'download_link', 'name']] == '').all(axis=1)
+    for pattern in EXCLUDED_PATTERNS:
+        for column in df.columns:
+            keep &= ~df[column].str.contains(pattern, regex=False)
+    df = df[keep].copy()
 
-if __name__ == "__main__":
-    # remove duplicate releases for each repository
-
-    input_file = 'download_data_raw.csv'
-    output_file = 'download_data_cleaned.csv'
-
-    df = pd.read_csv(input_file)
-    df['version'] = df['branch'].apply(extract_version)
+    df['version'] = df['branch'].str.extract(VERSION_REGEX, expand=False)
+    return df.drop_duplicates(subset=['repository', 'version'], keep='first')
 
-    repositories = df['repository'].unique()
 
-    filtered_dataframes = []
-    for repo in repositories:
-        repo_df = df[df['repository'] == repo]
-        duplicated_versions = repo_df[repo_df.duplicated(subset='version', keep=False)]
-        if not duplicated_versions.empty:
-            first_occurrence = duplicated_versions.drop_duplicates(subset='version', keep='first')
-            filtered_dataframes.append(first_occurrence)
-
-        non_duplicated_versions = repo_df[~repo_df.duplicated(subset='version', keep=False)]
-        filtered_dataframes.append(non_duplicated_versions)
-
-    final_df = pd.concat(filtered_dataframes, ignore_index=True)
-    final_df.to_csv(output_file, index=False)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_file', type=str, default='download_data_raw.csv')
+    parser.add_argument('--output_file', type=str, default='download_data_cleaned.csv')
+    args = parser.parse_args()
+
+    # values are kept as written by the miner (e.g., `None` is not a missing value)
+    df = pd.read_csv(args.input_file, dtype=str, keep_default_na=False)
+    clean_releases(df).to_csv(args.output_file, index=False)
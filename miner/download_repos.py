@@ -1,66 +1,207 @@
 import argparse
 import os
 import sys
-import time
-import requests
 import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from functools import partial
 
 import pandas as pd
 from tqdm import tqdm
 
+from extract_data import extract_archive
 from swh_miner import TOKEN
-from swh_utils import get_request_header
+from swh_utils import API_URL, NOT_FOUND_STATUS_CODES, RequestScheduler, get_session
+from vault_manager import VaultManager, get_directory_id
 
 tqdm_kwargs = {
     'bar_format': '{l_bar}{bar:100}{r_bar}{bar:-10b}',
     'file': sys.stdout
 }
 
+ARCHIVE_NAME = 'data.tar.gz'
+
+
+class ArchiveNotFoundError(Exception):
+    pass
+
+
+def get_release_dir(output_dir, row):
+    repository_url = row['repository']
+    if 'github' in repository_url or 'gitlab' in repository_url:
+        repo_name = repository_url.split('/')[-1]
+    else:
+        repo_name = repository_url.split('/')[-2]
+    repo_branch = row['branch'].replace('/', '-')
+    return f'{output_dir}/{repo_name}/{repo_branch}'
+
+
+def download_archive(scheduler, url, path, chunk_size=1024 ** 2):
+    """
+    Streams an archive to `{path}.part`, renamed to `path` once complete. Returns the number of bytes written.
+    Raises `ArchiveNotFoundError` if the archive does not exist (anymore).
+    """
+    part_path = f'{path}.part'
+    n_bytes = 0
+    try:
+        response = scheduler.request(url, stream=True, return_not_found=True)
+        if response is None:
+            raise RuntimeError('no successful response')
+        if response.status_code in NOT_FOUND_STATUS_CODES:
+            response.close()
+            raise ArchiveNotFoundError(f'[{response.status_code}] archive not found')
+        with response:
+            with open(part_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+                    n_bytes += len(chunk)
+        os.replace(part_path, path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return n_bytes
+
+
+def download_releases(data, output_dir, auth_token, num_workers=8, rate=5., burst=25, use_vault=True,
+                      vault_kwargs=None, extract_workers=0):
+    """
+    Downloads the archives of the releases that were not downloaded yet, with `num_workers` concurrent downloads
+    sharing a session and at most `rate` requests per second (bursts of `burst` requests).
+    With `use_vault`, the archives of vault links are first cooked (see `vault_manager.py`), and each archive is
+    downloaded as soon as it is ready. Bundles that expired before their download are cooked again, once.
+    With `extract_workers`, each archive is extracted as soon as it is downloaded (see `extract_data.py`).
+    """
+    scheduler = RequestScheduler(get_session(auth_token, pool_size=num_workers), rate=rate, burst=burst)
+
+    # archives to download, by vault directory (None for other links)
+    tasks = defaultdict(list)
+    n_tasks = 0
+    for _, row in data.iterrows():
+        release_dir = get_release_dir(output_dir, row)
+        archive_path = f'{release_dir}/{ARCHIVE_NAME}'
+        if os.path.exists(archive_path):
+            continue
+        os.makedirs(release_dir, exist_ok=True)
+        directory_id = get_directory_id(row['download_link']) if use_vault else None
+        tasks[directory_id].append((row['download_link'], archive_path))
+        n_tasks += 1
+
+    n_downloads = 0
+    n_bytes = 0
+    progress_bar = tqdm(total=n_tasks, **tqdm_kwargs)
+    extract_executor = ProcessPoolExecutor(max_workers=extract_workers) if extract_workers > 0 else None
+    extractions = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {}
+
+        def on_download(future, path):
+            progress_bar.update()
+            if extract_executor is not None and future.exception() is None:
+                extractions.append(extract_executor.submit(extract_archive, path))
+
+        def submit(url, path):
+            future = executor.submit(download_archive, scheduler, url, path)
+            future.add_done_callback(partial(on_download, path=path))
+            futures[future] = url
+            return future
+
+        for url, path in tasks.pop(None, []):
+            submit(url, path)
+
+        if tasks:
+            manager = VaultManager(scheduler, f'{output_dir}/vault_state.sqlite', **(vault_kwargs or {}))
+            retried = set()
+            directory_ids = list(tasks)
+            while directory_ids:
+                ready = manager.start(directory_ids)
+                downloads = {}
+                # bundles are downloaded as soon as they are cooked
+                while (item := ready.get()) is not None:
+                    directory_id, fetch_url = item
+                    for url, path in tasks.pop(directory_id, []):
+                        downloads[submit(fetch_url, path)] = directory_id, (url, path)
+
+                # the downloads of expired bundles are retried after cooking them again
+                wait(downloads)
+                expired = set()
+                for future, (directory_id, task) in downloads.items():
+                    if isinstance(future.exception(), ArchiveNotFoundError) and directory_id not in retried:
+                        del futures[future]
+                        tasks[directory_id].append(task)
+                        expired.add(directory_id)
+                        progress_bar.total += 1
+                for directory_id in expired:
+                    logging.info(f'Bundle {directory_id} expired, cooking it again')
+                    manager.reset(directory_id)
+                retried |= expired
+                directory_ids = list(expired)
+            for directory_id, directory_tasks in tasks.items():
+                for url, _ in directory_tasks:
+                    logging.info(f"Error downloading {url}: bundle {directory_id} could not be cooked")
+                    progress_bar.update()
+
+        for future in as_completed(futures):
+            try:
+                n_bytes += future.result()
+                n_downloads += 1
+            except Exception as e:
+                logging.info(f"Error downloading {futures[future]}: {e}")
+    progress_bar.close()
+
+    if extract_executor is not None:
+        for future in extractions:
+            try:
+                logging.info(f'Extracted {future.result()}')
+            except Exception as e:
+                logging.info(f'Error extracting: {e}')
+        extract_executor.shutdown()
+    logging.info(f'Downloaded {n_downloads}/{n_tasks} archives ({n_bytes / 1024 ** 2:.1f} MB)')
+    logging.info(f'Requests: {scheduler.get_metrics()}')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--download_data_fp", default="download_data.csv", type=str)
     parser.add_argument("--output_dir", default=None, type=str)
+    parser.add_argument("--num_workers", default=8, type=int, help="Number of concurrent downloads.")
+    parser.add_argument("--rate", default=5., type=float,
+                        help="Initial maximum number of requests per second, then adjusted to the rate limit "
+                             "reported by the API.")
+    parser.add_argument("--burst", default=25, type=int, help="Maximum number of requests sent in a burst.")
+    parser.add_argument("--no_vault", action='store_true',
+                        help="Download the links directly, without requesting their cooking to the vault first.")
+    parser.add_argument("--vault_batch_size", default=50, type=int,
+                        help="Number of cooking requests submitted at once.")
+    parser.add_argument("--vault_max_pending", default=200, type=int,
+                        help="Maximum number of bundles being cooked at once.")
+    parser.add_argument("--vault_poll_interval", default=30., type=float,
+                        help="Delay between two polls of the status of the bundles being cooked (seconds).")
+    parser.add_argument("--vault_bundle_ttl", default=7., type=float,
+                        help="Number of days after which a bundle cooked by a previous run is cooked again, as the "
+                             "vault deletes the bundles after a while.")
+    parser.add_argument("--vault_retry_failed", action='store_true',
+                        help="Request again the cooking of the bundles whose cooking failed in a previous run.")
+    parser.add_argument("--api_url", default=API_URL, type=str)
+    parser.add_argument("--extract_workers", default=0, type=int,
+                        help="Number of processes extracting the archives as soon as they are downloaded "
+                             "(0 to only download them).")
     args = parser.parse_args()
 
+    os.makedirs(args.output_dir, exist_ok=True)
     logging.basicConfig(
         filename=f'{args.output_dir}/download.log',
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
-    os.makedirs(args.output_dir, exist_ok=True)
     data = pd.read_csv(args.download_data_fp)
-
-    n = 0
-    n_download = 0
-    for index, row in tqdm(data.iterrows(), total=len(data), **tqdm_kwargs):
-        repository_url = row['repository']
-        if 'github' in repository_url or 'gitlab' in repository_url:
-            repo_name = repository_url.split('/')[-1]
-        else:
-            repo_name = repository_url.split('/')[-2]
-        repo_dir = f'{args.output_dir}/{repo_name}'
-
-        if not os.path.exists(repo_dir):
-            os.makedirs(repo_dir, exist_ok=True)
-
-        repo_branch = row['branch'].replace('/', '-')
-        repo_branch_dir = f'{repo_dir}/{repo_branch}'
-
-        if os.path.exists(f'{repo_branch_dir}/data.tar.gz'):
-            continue
-        os.makedirs(repo_branch_dir, exist_ok=True)
-
-        try:
-            header = get_request_header(TOKEN)
-            response = requests.get(row['download_link'], headers=header)
-            with open(f'{repo_branch_dir}/data.tar.gz', 'wb') as file:
-                file.write(response.content)
-        except Exception as e:
-            logging.info(f"Error downloading {row['download_link']}: {e}")
-
-        n_download += 1
-        # avoid too many requests error on SH API
-        if n_download % 25 == 0:
-            time.sleep(5)
+    vault_kwargs = {
+        'api_url': args.api_url,
+        'batch_size': args.vault_batch_size,
+        'max_pending': args.vault_max_pending,
+        'poll_interval': args.vault_poll_interval,
+        'bundle_ttl': args.vault_bundle_ttl * 24 * 3600,
+        'retry_failed': args.vault_retry_failed
+    }
+    download_releases(data, args.output_dir, TOKEN, args.num_workers, args.rate, args.burst, not args.no_vault,
+                      vault_kwargs, args.extract_workers)
@@ -0,0 +1,170 @@
+import argparse
+import fnmatch
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+tqdm_kwargs = {
+    'bar_format': '{l_bar}{bar:100}{r_bar}{bar:-10b}',
+    'file': sys.stdout
+}
+
+# only python files and requirements are extracted
+MEMBER_PATTERNS = ('*.py', 'requirements*.txt')
+# written once an archive is fully extracted, with its statistics
+MARKER_NAME = '.extracted'
+
+
+def is_extracted(extract_dir):
+    return os.path.exists(os.path.join(extract_dir, MARKER_NAME))
+
+
+def get_member_path(name, strip_components=1):
+    """
+    Relative path of an archive member once its first `strip_components` components are stripped, None if the
+    member is not extracted (stripped entirely, or outside the extraction directory).
+    """
+    components = [component for component in name.split('/') if component not in ('', '.')]
+    components = components[strip_components:]
+    if not components or '..' in components:
+        return None
+    return os.path.join(*components)
+
+
+def extract_archive(archive_path, extract_dir=None, patterns=MEMBER_PATTERNS, strip_components=1, force=False):
+    """
+    Extracts the files of an archive whose name matches one of `patterns`, in a single streaming pass over the
+    archive. Files are written to `extract_dir` (the directory of the archive by default) without their first
+    `strip_components` path components. Returns the statistics of the extraction.
+    """
+    extract_dir = extract_dir if extract_dir is not None else os.path.dirname(archive_path)
+    if is_extracted(extract_dir) and not force:
+        return None
+
+    start = time.perf_counter()
+    n_files = 0
+    n_bytes = 0
+    os.makedirs(extract_dir, exist_ok=True)
+    with tarfile.open(archive_path, mode='r|*') as archive:
+        for member in archive:
+            # links and special files are never extracted
+            if not member.isfile():
+                continue
+            if not any(fnmatch.fnmatchcase(os.path.basename(member.name), pattern) for pattern in patterns):
+                continue
+            member_path = get_member_path(member.name, strip_components)
+            if member_path is None:
+                continue
+
+            path = os.path.join(extract_dir, member_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.extractfile(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            n_files += 1
+            n_bytes += member.size
+
+    statistics = {
+        'archive': archive_path,
+        'archive_bytes': os.path.getsize(archive_path),
+        'files': n_files,
+        'bytes': n_bytes,
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+    with open(os.path.join(extract_dir, MARKER_NAME), 'w') as file:
+        json.dump(statistics, file)
+    return statistics
+
+
+def gunzip_archive(archive_path, force=False):
+    """
+    Decompresses a .tar.gz archive to a .tar archive next to it (read directly by the parser), removing the
+    .tar.gz once done. Returns the statistics of the decompression.
+    """
+    tar_path = archive_path[:-len('.gz')]
+    if os.path.exists(tar_path) and not force:
+        return None
+
+    start = time.perf_counter()
+    archive_bytes = os.path.getsize(archive_path)
+    with gzip.open(archive_path, 'rb') as source, open(f'{tar_path}.part', 'wb') as target:
+        shutil.copyfileobj(source, target, length=1024 ** 2)
+    os.replace(f'{tar_path}.part', tar_path)
+    os.remove(archive_path)
+    return {
+        'archive': archive_path,
+        'archive_bytes': archive_bytes,
+        'files': 1,
+        'bytes': os.path.getsize(tar_path),
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+
+def find_archives(data_dir, archive_name):
+    archives = []
+    for root, _, files in os.walk(data_dir):
+        if archive_name in files:
+            archives.append(os.path.join(root, archive_name))
+    return sorted(archives)
+
+
+def extract_archives(archives, data_dir, output_dir=None, num_workers=16, gunzip=False):
+    """
+    Extracts (or decompresses with `gunzip`) archives with a pool of `num_workers` processes. Files are extracted
+    to the same relative directory in `output_dir` (`data_dir` by default).
+    """
+    output_dir = output_dir if output_dir is not None else data_dir
+    total = {'archives': 0, 'skipped': 0, 'errors': 0, 'archive_bytes': 0, 'files': 0, 'bytes': 0, 'seconds': 0.}
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {}
+        for archive_path in archives:
+            if gunzip:
+                future = executor.submit(gunzip_archive, archive_path)
+            else:
+                extract_dir = os.path.join(output_dir, os.path.relpath(os.path.dirname(archive_path), data_dir))
+                future = executor.submit(extract_archive, archive_path, extract_dir)
+            futures[future] = archive_path
+
+        for future in tqdm(as_completed(futures), total=len(futures), **tqdm_kwargs):
+            try:
+                statistics = future.result()
+            except Exception as e:
+                logging.info(f'Error extracting {futures[future]}: {e}')
+                total['errors'] += 1
+                continue
+            if statistics is None:
+                total['skipped'] += 1
+                continue
+            logging.info(f'Extracted {statistics}')
+            total['archives'] += 1
+            for key in ('archive_bytes', 'files', 'bytes', 'seconds'):
+                total[key] += statistics[key]
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Directory where the files are extracted, with the same structure as `data_dir` '
+                             '(`data_dir` by default).')
+    parser.add_argument('--archive_name', type=str, default='data.tar.gz')
+    parser.add_argument('--num_workers', type=int, default=16)
+    parser.add_argument('--gunzip', action='store_true',
+                        help='Only decompress the .tar.gz archives to .tar archives.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    archives = find_archives(args.data_dir, args.archive_name)
+    total = extract_archives(archives, args.data_dir, args.output_dir, args.num_workers, args.gunzip)
+    print(f'Extracted {total["archives"]} archives ({total["skipped"]} already extracted, {total["errors"]} errors): '
+          f'{total["files"]} files, {total["bytes"] / 1024 ** 2:.1f} MB in {total["seconds"]:.1f}s of work')
@@ -3,7 +3,8 @@ import csv
 import os.path
 import re
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
 import swh_utils as swh
 
@@ -16,7 +17,7 @@ tqdm_kwargs = {
 }
 
 
-def fetch_repo_urls(origin, auth_token):
+def fetch_repo_urls(origin, auth_token, executor=None):
     data = []
     # get all the revisions for the current repo
     releases = swh.get_repo_releases_branches(origin, auth_token)
@@ -25,51 +26,88 @@ def fetch_repo_urls(origin, auth_token):
         print(f'Could not find any release for the repository {origin}.')
         return data
 
-    for branch_id, branch_data in releases['branches'].items():
-        # ignoring pull requests
-        if "pull" in branch_id:
-            continue
-        # ignoring branches that are not versions
-        match = re.search(version_regex, branch_id)
-        if match and branch_data['target_type'] == 'release' and ('github.com' in origin or 'gitlab' in origin):
-            revision_data = swh.run_request(branch_data['target_url'], auth_token=auth_token)
-            revision_data_content = revision_data.json()
-            target_url = revision_data_content['target_url']
-        else:
-            target_url = branch_data['target_url']
-
-        print(f'-- Fetching {origin} - branch {branch_id}')
-
-        url, name, date = swh.get_download_url(target_url, auth_token)
+    branches = [(branch_id, branch_data) for branch_id, branch_data in releases['branches'].items()
+                # ignoring pull requests
+                if "pull" not in branch_id]
+    # branches are resolved concurrently, in the order of the snapshot
+    fetch = partial(fetch_branch_url, origin=origin, auth_token=auth_token)
+    results = executor.map(fetch, branches) if executor is not None else map(fetch, branches)
+    for (branch_id, _), (url, name, date) in zip(branches, results):
         if url is not None:
             data.append((branch_id, url, name, date))
-        print('-' * 100)
 
     return data
 
 
+def fetch_branch_url(branch, origin, auth_token):
+    branch_id, branch_data = branch
+    # ignoring branches that are not versions
+    match = re.search(version_regex, branch_id)
+    if match and branch_data['target_type'] == 'release' and ('github.com' in origin or 'gitlab' in origin):
+        revision_data_content = swh.get_json(branch_data['target_url'], auth_token=auth_token)
+        if revision_data_content is None:
+            return None, None, None
+        target_url = revision_data_content['target_url']
+    else:
+        target_url = branch_data['target_url']
+
+    print(f'-- Fetching {origin} - branch {branch_id}')
+    return swh.get_download_url(target_url, auth_token)
+
+
+def get_mined_origins(output_file):
+    # origins already written by a previous run
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, 'r', newline='') as f:
+        return {row['repository'] for row in csv.DictReader(f)}
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_file", type=str, default=None)
+    parser.add_argument("--num_workers", type=int, default=8, help="Number of origins mined concurrently.")
+    parser.add_argument("--num_branch_workers", type=int, default=16,
+                        help="Number of branches resolved concurrently, shared by all origins.")
+    parser.add_argument("--cache_fp", type=str, default=None,
+                        help="Cache of the immutable API responses (default: `swh_cache.sqlite` in the input file "
+                             "directory).")
     args = parser.parse_args()
 
-    output_file = os.path.join(os.path.dirname(args.input_file), 'download_data_raw.csv')
+    input_dir = os.path.dirname(args.input_file)
+    output_file = os.path.join(input_dir, 'download_data_raw.csv')
+    swh.set_response_cache(swh.ResponseCache(args.cache_fp or os.path.join(input_dir, 'swh_cache.sqlite')))
 
     with open(args.input_file, 'r') as f:
         repos_set = [url.strip() for url in f.readlines()]
 
-    with open(output_file, 'w', newline='') as fout:
-        writer = csv.writer(fout)
-        writer.writerow(['repository', 'branch', 'download_link', 'name', 'date'])
+    # a resumed run appends the origins that were not mined yet
+    mined_origins = get_mined_origins(output_file)
+    origins = [origin for origin in repos_set if origin not in mined_origins]
 
-        for origin in repos_set:
-            repo_releases_data = fetch_repo_urls(origin, TOKEN)
+    with open(output_file, 'a' if mined_origins else 'w', newline='') as fout, \
+            ThreadPoolExecutor(max_workers=args.num_branch_workers) as branch_executor, \
+            ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+        writer = csv.writer(fout)
+        if not mined_origins:
+            writer.writerow(['repository', 'branch', 'download_link', 'name', 'date'])
+
+        futures = {executor.submit(fetch_repo_urls, origin, TOKEN, branch_executor): origin for origin in origins}
+        # each origin is written as soon as all its branches are resolved
+        for future in as_completed(futures):
+            origin = futures[future]
+            try:
+                repo_releases_data = future.result()
+            except Exception as e:
+                print(f'Could not mine the repository {origin}: {e}')
+                continue
 
             if not repo_releases_data:
                 writer.writerow([origin, 'None', 'None', 'None', 'None'])
             else:
                 for id, url, name, date in repo_releases_data:
                     writer.writerow([origin, id, url, name, date])
+            fout.flush()
 
-            # avoid too many requests error
-            time.sleep(10)
+    # requests are throttled according to the rate limit of the API, see `swh_utils.RequestScheduler`
+    print(f'Requests: {swh.get_scheduler(TOKEN).get_metrics()}')
@@ -1,71 +1,311 @@
 import http.client
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
 import time
+import zlib
+from email.utils import parsedate_to_datetime
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
-SEARCH_VAULT = "https://archive.softwareheritage.org/api/1/vault/directory/"
-SEARCH_ORIGINS = "https://archive.softwareheritage.org/api/1/origin/"
-SEARCH_SNAPSHOT = "https://archive.softwareheritage.org/api/1/snapshot/"
+API_URL = "https://archive.softwareheritage.org/api/1/"
+SEARCH_VAULT = f"{API_URL}vault/flat/"
+SEARCH_ORIGINS = f"{API_URL}origin/"
+SEARCH_SNAPSHOT = f"{API_URL}snapshot/"
+# the resource does not exist, or no longer exists (e.g., an expired vault bundle)
+NOT_FOUND_STATUS_CODES = (404, 410)
 
 
 def get_request_header(token):
     return {'Authorization': f'Bearer {token}'}
 
 
-def run_request(url, auth_token, request_type='get', max_attempts=5):
-    request_func = getattr(requests, request_type)
+def get_session(auth_token, pool_size=16):
+    """
+    Session shared by concurrent workers, keeping up to `pool_size` connections alive.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(get_request_header(auth_token))
+    return session
+
+
+class TokenBucket:
+    """
+    Thread-safe rate limiter: allows bursts of `capacity` requests, refilled at `rate` requests per second.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+
+
+class RequestScheduler:
+    """
+    Sends the requests of all the workers (threads) of a process to the Software Heritage API:
+    - requests are throttled by a shared token bucket, whose rate follows the `X-RateLimit-*` headers of the API;
+    - a 429 response pauses all the workers until `Retry-After` (or the rate limit reset);
+    - server and connection errors are retried with an exponential backoff with jitter.
+    Metrics (requests/s, retries, throttled time) are available with `get_metrics`.
+    """
+    RETRY_EXCEPTIONS = (http.client.RemoteDisconnected, requests.exceptions.ReadTimeout,
+                        requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout,
+                        requests.exceptions.SSLError, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, session=None, rate=None, burst=1, max_attempts=5, backoff_base=1., backoff_max=60.,
+                 timeout=60):
+        self.session = session if session is not None else requests.Session()
+        # without a rate, requests are only throttled once the API reports its rate limit
+        self.rate_limiter = TokenBucket(rate, capacity=burst) if rate is not None else None
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.paused_until = 0.
+        self.metrics = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'throttled_time': 0.}
+        self.start_time = time.monotonic()
+
+    def request(self, url, request_type='get', max_attempts=None, return_not_found=False, **kwargs):
+        """
+        Returns the response of a successful request, None if the URL does not exist (or its response with
+        `return_not_found`) or after `max_attempts`.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(max_attempts or self.max_attempts):
+            if attempt > 0:
+                self.add_metric('retries')
+            self.wait()
+            try:
+                response = self.session.request(request_type, url, **kwargs)
+            except self.RETRY_EXCEPTIONS:
+                self.add_metric('errors')
+                self.sleep(self.get_backoff(attempt))
+                continue
+            self.add_metric('requests')
+            self.update_rate_limit(response.headers)
 
-    for attempt in range(max_attempts):
-        try:
-            header = get_request_header(auth_token)
-            response = request_func(url, headers=header)
             if response.status_code == 200:
                 return response
-            elif response.status_code == 404:
-                print(f'[404] - URL {url} not found.')
+            elif response.status_code in NOT_FOUND_STATUS_CODES:
+                print(f'[{response.status_code}] - URL {url} not found.')
+                if return_not_found:
+                    return response
                 break
-            elif response.status_code == 500:
-                print(f'[500] - Could not process request.')
             elif response.status_code == 429:
                 print(f'Too many requests.')
-                time.sleep(1000)
-        except (http.client.RemoteDisconnected, requests.exceptions.ReadTimeout,
-                requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout,
-                requests.exceptions.SSLError):
-            pass
+                self.add_metric('throttled')
+                self.pause(self.get_retry_after(response.headers, attempt))
+            else:
+                print(f'[{response.status_code}] - Could not process request.')
+                self.add_metric('errors')
+                self.sleep(self.get_backoff(attempt))
+            response.close()
 
-    return None
+        return None
+
+    def wait(self):
+        # shared pause after a 429 response, then the rate limit of the token bucket
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        self.add_metric('throttled_time', time.monotonic() - start)
+
+    def pause(self, delay):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def sleep(self, delay):
+        self.add_metric('throttled_time', delay)
+        time.sleep(delay)
+
+    def get_backoff(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_retry_after(self, headers, attempt):
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return max(0., float(retry_after))
+            except ValueError:
+                try:
+                    return max(0., parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        reset = self.get_reset_delay(headers)
+        return reset if reset is not None else self.get_backoff(attempt)
+
+    @staticmethod
+    def get_reset_delay(headers):
+        # the reset header is a timestamp of the end of the rate limit window
+        try:
+            return max(0., float(headers['X-RateLimit-Reset']) - time.time())
+        except (KeyError, ValueError):
+            return None
+
+    def update_rate_limit(self, headers):
+        """
+        Spreads the remaining requests of the rate limit window over the time left in that window.
+        """
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+        except (KeyError, ValueError):
+            return
+        reset_delay = self.get_reset_delay(headers)
+        if reset_delay is None:
+            return
+        if remaining <= 0:
+            self.pause(reset_delay)
+            return
+        rate = remaining / max(reset_delay, 1.)
+        with self.lock:
+            if self.rate_limiter is None:
+                self.rate_limiter = TokenBucket(rate)
+            else:
+                self.rate_limiter.set_rate(rate)
+
+    def add_metric(self, name, value=1):
+        with self.lock:
+            self.metrics[name] += value
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        elapsed = time.monotonic() - self.start_time
+        metrics['requests_per_second'] = metrics['requests'] / elapsed if elapsed > 0 else 0.
+        return metrics
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(auth_token, **kwargs):
+    """
+    Returns the scheduler shared by all the requests of the process made with `auth_token`.
+    """
+    with _schedulers_lock:
+        if auth_token not in _schedulers:
+            _schedulers[auth_token] = RequestScheduler(get_session(auth_token), **kwargs)
+        return _schedulers[auth_token]
+
+
+def run_request(url, auth_token, request_type='get', max_attempts=5):
+    return get_scheduler(auth_token).request(url, request_type, max_attempts)
+
+
+class ResponseCache:
+    """
+    On-disk cache of the JSON content of API responses, keyed by URL. Only immutable objects (snapshots, releases,
+    revisions and directories, which are addressed by their content hash) are cached.
+    """
+    IMMUTABLE_URL_REGEX = re.compile(r'/api/1/(snapshot|release|revision|directory)/[0-9a-f]{40}(/|\?|$)')
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # a single connection shared by the threads of the process
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, content BLOB)')
+        self.lock = threading.Lock()
+
+    def is_cacheable(self, url):
+        return self.IMMUTABLE_URL_REGEX.search(url) is not None
+
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute('SELECT content FROM responses WHERE url = ?', (url,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row is not None else None
+
+    def put(self, url, content):
+        data = zlib.compress(json.dumps(content).encode('utf-8'))
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?)', (url, data))
+
+
+_response_cache = None
+
+
+def set_response_cache(cache):
+    global _response_cache
+    _response_cache = cache
+
+
+def get_json(url, auth_token, request_type='get'):
+    """
+    Returns the JSON content of a request, from the response cache for immutable objects (see `set_response_cache`).
+    """
+    cacheable = request_type == 'get' and _response_cache is not None and _response_cache.is_cacheable(url)
+    if cacheable:
+        content = _response_cache.get(url)
+        if content is not None:
+            return content
+
+    response = run_request(url, auth_token, request_type)
+    if response is None:
+        return None
+    content = response.json()
+    if cacheable:
+        _response_cache.put(url, content)
+    return content
 
 
 def get_repo_releases_branches(origin, auth_token):
-    repo_snapshot = run_request(f'{SEARCH_ORIGINS}{origin}/visit/latest/', auth_token=auth_token)
+    repo_snapshot_content = get_json(f'{SEARCH_ORIGINS}{origin}/visit/latest/', auth_token=auth_token)
 
-    if repo_snapshot is not None:
-        repo_snapshot_content = repo_snapshot.json()
-        repo_release_branches = run_request(f'{SEARCH_SNAPSHOT}{repo_snapshot_content["snapshot"]}',
-                                            auth_token=auth_token)
-        if repo_release_branches is not None:
-            repo_release_branches_content = repo_release_branches.json()
-            return repo_release_branches_content
+    if repo_snapshot_content is not None and repo_snapshot_content.get('snapshot') is not None:
+        return get_json(f'{SEARCH_SNAPSHOT}{repo_snapshot_content["snapshot"]}', auth_token=auth_token)
 
     return None
 
 
 def get_download_url(target_url, auth_token):
-    release_data = run_request(target_url, auth_token)
+    """
+    Returns the vault download link of the directory of a release, which is cooked later on (see `vault_manager.py`).
+    """
+    release_data_content = get_json(target_url, auth_token)
 
-    if release_data is not None:
-        release_data_content = release_data.json()
+    if release_data_content is not None:
         if isinstance(release_data_content, list):
             return None, None, None
         release_id = release_data_content.get('target', release_data_content.get('directory'))
-        release = run_request(f'{SEARCH_VAULT}{release_id}/', auth_token=auth_token, request_type='post')
         release_name = release_data_content.get('name', 'None')
         release_date = release_data_content.get('date', 'None')
 
-        if release is not None:
-            release_content = release.json()
-            return release_content['fetch_url'], release_name, release_date
+        if release_id is not None:
+            return f'{SEARCH_VAULT}swh:1:dir:{release_id}/raw/', release_name, release_date
 
     return None, None, None
@@ -0,0 +1,147 @@
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from swh_utils import API_URL
+
+DIRECTORY_ID_REGEX = re.compile(r'swh:1:dir:([0-9a-f]{40})')
+
+
+def get_directory_id(download_link):
+    """
+    Returns the id of the directory of a vault download link (see `swh_utils.get_download_url`), None otherwise.
+    """
+    match = DIRECTORY_ID_REGEX.search(str(download_link))
+    return match.group(1) if match else None
+
+
+class VaultManager:
+    """
+    Cooks the archives of directories with the Software Heritage vault. Cooking requests are submitted in batches
+    (at most `max_pending` bundles being cooked at once), their status is polled concurrently, and bundles are
+    handed out as soon as they are ready. The status of the bundles is persisted in `state_path`, so that a restart
+    neither submits the bundles again nor waits for the bundles already cooked. The vault deletes the bundles after a
+    while: bundles cooked more than `bundle_ttl` seconds ago are cooked again. Bundles whose requests failed (e.g.,
+    server or connection errors) are submitted again by the next run, bundles whose cooking failed only with
+    `retry_failed`.
+    """
+    def __init__(self, scheduler, state_path, api_url=API_URL, batch_size=50, max_pending=200, poll_interval=30.,
+                 num_workers=8, retry_failed=False, bundle_ttl=7 * 24 * 3600.):
+        self.scheduler = scheduler
+        self.state_path = state_path
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.num_workers = num_workers
+        self.retry_failed = retry_failed
+        self.bundle_ttl = bundle_ttl
+
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        # only used by the thread iterating over the ready bundles (and by `reset` once it ended)
+        self.connection = sqlite3.connect(state_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS bundles '
+                                '(directory_id TEXT PRIMARY KEY, status TEXT, fetch_url TEXT, message TEXT, '
+                                'updated_at REAL)')
+
+    def get_bundle_url(self, directory_id):
+        return f'{self.api_url}vault/flat/swh:1:dir:{directory_id}/'
+
+    def get_state(self):
+        return {directory_id: (status, fetch_url, updated_at) for directory_id, status, fetch_url, updated_at
+                in self.connection.execute('SELECT directory_id, status, fetch_url, updated_at FROM bundles')}
+
+    def save_state(self, directory_id, status, fetch_url=None, message=None):
+        self.connection.execute('INSERT OR REPLACE INTO bundles VALUES (?, ?, ?, ?, ?)',
+                                (directory_id, status, fetch_url, message, time.time()))
+
+    def reset(self, directory_id):
+        """
+        Forgets the status of a bundle, e.g. when it expired before its download, so that it is cooked again.
+        """
+        self.connection.execute('DELETE FROM bundles WHERE directory_id = ?', (directory_id,))
+
+    def request_bundle(self, directory_id, request_type):
+        """
+        Submits (post) or polls (get) the cooking of a bundle. Returns (status, fetch_url, message), the status is
+        'error' if the request failed, unlike 'failed' for a cooking failure reported by the vault.
+        """
+        response = self.scheduler.request(self.get_bundle_url(directory_id), request_type)
+        if response is None:
+            return 'error', None, 'request failed'
+        content = response.json()
+        fetch_url = content.get('fetch_url') or f'{self.get_bundle_url(directory_id)}raw/'
+        return content.get('status', 'failed'), fetch_url, content.get('progress_message')
+
+    def iter_ready(self, directory_ids):
+        """
+        Yields (directory_id, fetch_url) for each bundle of `directory_ids`, as soon as it is cooked.
+        """
+        state = self.get_state()
+        to_submit = deque()
+        pending = set()
+        for directory_id in dict.fromkeys(directory_ids):
+            status, fetch_url, updated_at = state.get(directory_id, (None, None, None))
+            if status == 'done' and time.time() - updated_at > self.bundle_ttl:
+                logging.info(f'Cooking bundle {directory_id} again, it may have expired')
+                to_submit.append(directory_id)
+            elif status == 'done':
+                yield directory_id, fetch_url
+            elif status in ('new', 'pending'):
+                pending.add(directory_id)
+            elif status == 'failed' and not self.retry_failed:
+                logging.info(f'Skipping bundle {directory_id}, its cooking failed')
+            else:
+                to_submit.append(directory_id)
+
+        last_poll = 0.
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            while to_submit or pending:
+                n_submit = min(self.batch_size, self.max_pending - len(pending), len(to_submit))
+                batch = [(to_submit.popleft(), 'post') for _ in range(max(n_submit, 0))]
+                # bundles are polled every `poll_interval` seconds
+                if pending and time.monotonic() - last_poll >= self.poll_interval:
+                    batch += [(directory_id, 'get') for directory_id in pending]
+                    last_poll = time.monotonic()
+                if not batch:
+                    time.sleep(max(0., self.poll_interval - (time.monotonic() - last_poll)))
+                    continue
+
+                results = executor.map(lambda item: self.request_bundle(*item), batch)
+                for (directory_id, _), (status, fetch_url, message) in zip(batch, results):
+                    self.save_state(directory_id, status, fetch_url, message)
+                    if status == 'done':
+                        pending.discard(directory_id)
+                        yield directory_id, fetch_url
+                    elif status == 'failed':
+                        pending.discard(directory_id)
+                        logging.info(f'Could not cook bundle {directory_id}: {message}')
+                    elif status == 'error':
+                        pending.discard(directory_id)
+                        logging.info(f'Could not request bundle {directory_id}, it is submitted again by the next run')
+                    else:
+                        pending.add(directory_id)
+
+    def start(self, directory_ids):
+        """
+        Runs `iter_ready` in a background thread. Returns a queue of ready (directory_id, fetch_url), ended by None.
+        """
+        ready = queue.Queue()
+
+        def run():
+            try:
+                for item in self.iter_ready(directory_ids):
+                    ready.put(item)
+            except Exception:
+                logging.exception('Vault manager stopped')
+            finally:
+                ready.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        return ready
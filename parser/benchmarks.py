@@ -0,0 +1,264 @@
+import argparse
+import ast
+import gc
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from code_change_comparators import MethodComparator, PythonFileComparator, RepositoryComparator
+from code_change_data_generator import ReleasePipeline, get_releases, read_download_data
+from parser import Repository
+from synthetic_releases import generate_releases
+from writers import JsonlWriter
+
+# stages of the generator timed by `bench_pipeline`, in order
+PIPELINE_STAGES = ('parse', 'map_files', 'map_methods', 'map_function_calls', 'compare', 'write_jsonl')
+
+
+def legacy_retrieve_function_calls(method):
+    # reference implementation: nested calls are visited once per ancestor and offsets re-split the content
+    function_calls = []
+
+    def process_call_node(node):
+        if isinstance(node, ast.Call):
+            context = method.get_call_context(node)
+            function_name = method.get_call_name(node)
+
+            fc_name = function_name
+            if context is not None:
+                fc_name = context
+                context = function_name
+
+            if fc_name:
+                function_call_expr = ast.unparse(node)
+                start_line = node.lineno - 1
+                lines = method.content.split('\n')
+                start_offset = sum(len(line) + 1 for line in lines[:start_line]) + node.col_offset
+                end_offset = start_offset + len(function_call_expr)
+                fc = (function_call_expr, start_offset, end_offset, start_line)
+                if fc not in function_calls:
+                    function_calls.append(fc)
+        for child_node in ast.iter_child_nodes(node):
+            process_call_node(child_node)
+
+    tree = ast.parse(method.content)
+    for node in ast.walk(tree):
+        process_call_node(node)
+    return function_calls
+
+
+def retrieve_function_calls(method):
+    method.retrieve_function_calls()
+    return [(fc.expression, fc.start_offset, fc.end_offset, fc.line.line_number) for fc in method.function_calls]
+
+
+def bench_function_calls(repository_dir, min_lines=100, repeat=3):
+    repository = Repository(repository_dir, num_workers=0)
+    methods = [m for file in repository.files for m in file.methods
+               if m.content is not None and m.content.count('\n') + 1 >= min_lines]
+    print(f'Extracting function calls from {len(methods)} methods with at least {min_lines} lines')
+
+    timings = {}
+    for name, extract in (('legacy', legacy_retrieve_function_calls), ('single-pass', retrieve_function_calls)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for m in methods:
+                extract(m)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        print(f'{name:>12}: {best:.3f}s')
+
+    mismatches = [m for m in methods if legacy_retrieve_function_calls(m) != retrieve_function_calls(m)]
+    print(f'Speedup: {timings["legacy"] / timings["single-pass"]:.1f}x - {len(mismatches)} mismatching methods')
+    return timings, mismatches
+
+
+def get_rss():
+    # resident set size of the process in bytes (Linux)
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def bench_memory(repository_dir):
+    """
+    Memory held by a parsed release: size of the objects allocated while building the repository (tracemalloc)
+    and increase of the RSS of the process.
+    """
+    gc.collect()
+    rss_before = get_rss()
+    tracemalloc.start()
+    repository = Repository(repository_dir, num_workers=0, show_progress=False)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = get_rss() - rss_before
+
+    n_methods = sum(len(file.methods) for file in repository.files)
+    n_function_calls = sum(len(m.fc_names) for file in repository.files for m in file.methods)
+    print(f'{len(repository.files)} files, {n_methods} methods, {n_function_calls} function calls')
+    print(f'Allocated: {allocated / 1024 ** 2:.1f} MB ({allocated / max(n_methods, 1):.0f} B per method) - '
+          f'RSS increase: {rss / 1024 ** 2:.1f} MB')
+    return allocated, rss
+
+
+def bench_pipeline(data_dir, download_data_fp):
+    """
+    Times the stages of the generator on the releases of `download_data_fp`, as the generator compares them:
+    parsing the releases, mapping the files, the methods of the mapped files and the function calls of the changed
+    methods, comparing the releases (mappings and statistics of the records) and writing the .jsonl records.
+    Returns the duration and throughput (files and methods per second) of each stage, and the peak RSS.
+    """
+    stages = {stage: defaultdict(int) for stage in PIPELINE_STAGES}
+
+    def add_timing(stage, start, n_files=0, n_methods=0):
+        stages[stage]['seconds'] += time.perf_counter() - start
+        stages[stage]['files'] += n_files
+        stages[stage]['methods'] += n_methods
+
+    n_releases = 0
+    n_pairs = 0
+    df_list = read_download_data(download_data_fp)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for repo_df in df_list:
+            repository_name, releases, release_dirs = get_releases(repo_df, data_dir)
+            n_releases += len(releases)
+            repositories = {}
+            with JsonlWriter(os.path.join(output_dir, f'{repository_name}.jsonl')) as writer:
+                for i, j in ReleasePipeline(release_dirs).get_release_pairs():
+                    for index in (i, j):
+                        if index not in repositories:
+                            start = time.perf_counter()
+                            repository = Repository(release_dirs[index], num_workers=0, show_progress=False)
+                            add_timing('parse', start, len(repository.files),
+                                       sum(len(file.methods) for file in repository.files))
+                            repositories[index] = repository
+                    repository1, repository2 = repositories[i], repositories[j]
+
+                    start = time.perf_counter()
+                    comparator = RepositoryComparator(repository1, repository2)
+                    add_timing('map_files', start, len(repository1.files) + len(repository2.files))
+
+                    file_pairs = [(file1, file2) for file1, file2 in comparator.files_mapping
+                                  if not isinstance(file2, str)]
+                    start = time.perf_counter()
+                    methods_mappings = [PythonFileComparator(file1, file2, compare=False).methods_mapping
+                                        for file1, file2 in file_pairs]
+                    add_timing('map_methods', start, len(file_pairs), sum(map(len, methods_mappings)))
+
+                    method_pairs = [(m1, m2) for methods_mapping in methods_mappings for m1, m2 in methods_mapping
+                                    if not isinstance(m2, str) and m1.content_hash != m2.content_hash]
+                    start = time.perf_counter()
+                    for m1, m2 in method_pairs:
+                        MethodComparator(m1, m2, compare=False)
+                    add_timing('map_function_calls', start, n_methods=len(method_pairs))
+
+                    start = time.perf_counter()
+                    initial_entries = list(comparator.iter_initial_release_data()) if i == 0 else []
+                    entries = list(comparator.files_data)
+                    n_files = len(initial_entries) + len(entries)
+                    n_methods = sum(len(entry['methods']) for entry in initial_entries + entries)
+                    add_timing('compare', start, n_files, n_methods)
+
+                    # same records as `process_repository`, with the metadata of the releases
+                    start = time.perf_counter()
+                    for entry in initial_entries:
+                        writer.write({**releases[i], "prev_branch": None, **entry})
+                    for entry in entries:
+                        writer.write({**releases[j], "prev_branch": releases[i]["branch"], **entry})
+                    writer.checkpoint()
+                    add_timing('write_jsonl', start, n_files, n_methods)
+
+                    # same as the generator: restore the order of the function calls, only keep the last release
+                    repositories[j].restore_function_calls_order()
+                    for index in [index for index in repositories if index < j]:
+                        del repositories[index]
+                    n_pairs += 1
+
+    for stage in stages.values():
+        seconds = stage['seconds']
+        stage['files_per_second'] = stage['files'] / seconds if seconds > 0 else None
+        stage['methods_per_second'] = stage['methods'] / seconds if seconds > 0 else None
+    return {
+        'repositories': len(df_list),
+        'releases': n_releases,
+        'release_pairs': n_pairs,
+        'stages': {name: dict(stage) for name, stage in stages.items()},
+        'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repository_dir', type=str, default=None,
+                        help='Directory of a release, e.g., a catboost release with large generated methods.')
+    parser.add_argument('--min_lines', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--memory', action='store_true', help='Measure the memory held by a parsed release.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Time the stages of the generator on the releases of `--data_dir` and '
+                             '`--download_data_fp`, or on a synthetic release history if not set.')
+    parser.add_argument('--data_dir', type=str, default=None)
+    parser.add_argument('--download_data_fp', type=str, default=None)
+    parser.add_argument('--results_fp', type=str, default=None,
+                        help='.json file where the results of `--pipeline` are saved, to compare runs.')
+    parser.add_argument('--n_repositories', type=int, default=1)
+    parser.add_argument('--n_releases', type=int, default=5)
+    parser.add_argument('--n_files', type=int, default=100)
+    parser.add_argument('--n_methods', type=int, default=10, help='Number of methods per file.')
+    parser.add_argument('--method_lines', type=int, default=20, help='Average number of lines of a method.')
+    parser.add_argument('--call_density', type=float, default=.5,
+                        help='Probability that a line of a method has a function call.')
+    parser.add_argument('--mutation_rate', type=float, default=.1,
+                        help='Fraction of the methods modified between two releases.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.pipeline:
+        benchmark = {}
+        with tempfile.TemporaryDirectory() as synthetic_dir:
+            if args.download_data_fp is not None:
+                benchmark['dataset'] = {'data_dir': args.data_dir, 'download_data_fp': args.download_data_fp}
+                data_dir, download_data_fp = args.data_dir, args.download_data_fp
+            else:
+                synthetic_kwargs = {
+                    'n_files': args.n_files,
+                    'n_methods': args.n_methods,
+                    'method_lines': args.method_lines,
+                    'call_density': args.call_density,
+                    'mutation_rate': args.mutation_rate,
+                    'seed': args.seed
+                }
+                benchmark['dataset'] = {'n_repositories': args.n_repositories, 'n_releases': args.n_releases,
+                                        **synthetic_kwargs}
+                data_dir = synthetic_dir
+                download_data_fp = generate_releases(synthetic_dir, args.n_repositories, args.n_releases,
+                                                     **synthetic_kwargs)
+            benchmark['environment'] = {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count()
+            }
+            benchmark['results'] = bench_pipeline(data_dir, download_data_fp)
+
+        for name, stage in benchmark['results']['stages'].items():
+            print(f'{name:>18}: {stage["seconds"]:8.3f}s - {stage["files"]:>7} files '
+                  f'({stage["files_per_second"] or 0:10.1f}/s) - {stage["methods"]:>8} methods '
+                  f'({stage["methods_per_second"] or 0:10.1f}/s)')
+        print(f'Total: {benchmark["results"]["total_seconds"]:.3f}s - '
+              f'peak RSS: {benchmark["results"]["peak_rss_mb"]:.1f} MB')
+        if args.results_fp is not None:
+            with open(args.results_fp, 'w') as file:
+                json.dump(benchmark, file, indent=2)
+    elif args.memory:
+        bench_memory(args.repository_dir)
+    else:
+        bench_function_calls(args.repository_dir, args.min_lines, args.repeat)
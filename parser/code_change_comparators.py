@@ -1,8 +1,15 @@
+import heapq
 import os
+from collections import defaultdict, deque
 
 import Levenshtein
 
+from line_diff import get_line_diff
 from parser import Repository, PythonFile, Method
+from scoring import Scorer
+
+# scorer of the comparators created without one, the statistics are not cut off
+DEFAULT_SCORER = Scorer()
 
 
 class Comparator:
@@ -11,8 +18,9 @@ class Comparator:
         return Levenshtein.ratio(str1, str2), Levenshtein.distance(str1, str2)
 
     @staticmethod
-    def levenshtein_ratio(str1, str2):
-        return Levenshtein.ratio(str1, str2)
+    def levenshtein_ratio(str1, str2, score_cutoff=None):
+        # ratios lower than `score_cutoff` are 0
+        return Levenshtein.ratio(str1, str2, score_cutoff=score_cutoff)
 
     @staticmethod
     def get_line_count(content):
@@ -23,52 +31,84 @@ class RepositoryComparator(Comparator):
     RATIO_FILE_NAMES_SIMILARITY = .75
     RATIO_FILE_COMMON_METHODS = .50
 
-    def __init__(self, repo1: Repository, repo2: Repository):
+    def __init__(self, repo1: Repository, repo2: Repository, scorer: Scorer = None, line_diff=False):
         self.repo1 = repo1
         self.repo2 = repo2
+        self.scorer = scorer if scorer is not None else DEFAULT_SCORER
+        self.line_diff = line_diff
 
         self.files_mapping = list(self.map_files())
-        self.files_data = list(self.compare_files())
+
+    @property
+    def files_data(self):
+        # files are compared as the data is consumed, so that a release is never held in memory as a whole
+        return self.compare_files()
 
     def map_files(self):
         f1_parsed = set()
         f2_parsed = set()
 
+        # exact relative paths of the files in the new release
+        files2_by_path = {}
+        # file names of the new release, with the positions of the files and grouped by name length
+        files2_by_name = defaultdict(list)
+        names2_by_length = defaultdict(set)
+        for index, file2 in enumerate(self.repo2.files):
+            files2_by_path.setdefault(file2.relative_path, file2)
+            file2_name = os.path.split(str(file2))[-1]
+            files2_by_name[file2_name].append(index)
+            names2_by_length[len(file2_name)].add(file2_name)
+        names_ratios = {}
+        # method names of the files of the new release, computed when first needed
+        files2_methods = [None] * len(self.repo2.files)
+
         for file1 in self.repo1.files:
             if file1 in f1_parsed:
                 continue
             # check for exact match between relative paths first
-            for file2 in self.repo2.files:
-                # calls __eq__ and compare relative paths
-                if file1 == file2:
-                    yield file1, file2
-                    f1_parsed.add(file1)
-                    f2_parsed.add(file2)
-                    break
+            file2 = files2_by_path.get(file1.relative_path)
+            if file2 is not None:
+                yield file1, file2
+                f1_parsed.add(file1)
+                f2_parsed.add(file2)
 
             # check for files with very similar names and a high ratio of shared methods
             if file1 not in f1_parsed:
-                # make sure a file is not mapped twice
-                repo2_files_filtered = [f2 for f2 in self.repo2.files if f2 not in f2_parsed]
-                for file2 in repo2_files_filtered:
-                    file1_name = os.path.split(str(file1))[-1]
-                    file2_name = os.path.split(str(file2))[-1]
-
-                    # check if file names are very similar
-                    ratio_file_names = self.levenshtein_ratio(file1_name, file2_name)
-                    if not ratio_file_names > self.RATIO_FILE_NAMES_SIMILARITY:
+                file1_name = os.path.split(str(file1))[-1]
+                # only the file names whose length allows a high enough ratio are compared
+                similar_names = []
+                for length in self.get_similar_name_lengths(len(file1_name), names2_by_length):
+                    for file2_name in names2_by_length[length]:
+                        if (file1_name, file2_name) not in names_ratios:
+                            # ratios lower than the threshold are not needed exactly
+                            names_ratios[file1_name, file2_name] = self.levenshtein_ratio(
+                                file1_name, file2_name, score_cutoff=self.RATIO_FILE_NAMES_SIMILARITY)
+                        if names_ratios[file1_name, file2_name] > self.RATIO_FILE_NAMES_SIMILARITY:
+                            similar_names.append(file2_name)
+
+                # candidates are visited in the order of the new release, make sure a file is not mapped twice
+                candidates = heapq.merge(*[files2_by_name[name] for name in similar_names])
+                file1_methods = None
+                for index in candidates:
+                    file2 = self.repo2.files[index]
+                    if file2 in f2_parsed:
                         continue
 
                     # check the ratio of shared methods
-                    file1_methods = [m.name for m in file1.methods]
-                    file2_methods = [m.name for m in file2.methods]
-
-                    if len(file1_methods) > 0 and len(file2_methods) > 0:
-                        shortest_list = min(file1_methods, file2_methods, key=len)
-                        longest_list = max(file1_methods, file2_methods, key=len)
-
-                        common_method = set(shortest_list) & set(longest_list)
-                        ratio_common_methods = len(common_method) / len(shortest_list)
+                    if file1_methods is None:
+                        file1_methods, n_file1_methods = self.get_method_names(file1)
+                    if files2_methods[index] is None:
+                        files2_methods[index] = self.get_method_names(file2)
+                    file2_methods, n_file2_methods = files2_methods[index]
+
+                    if n_file1_methods > 0 and n_file2_methods > 0:
+                        # same as before indexing: with lists of equal length, the shortest and longest lists
+                        # were both the methods of `file1`
+                        if n_file1_methods == n_file2_methods:
+                            common_method = file1_methods
+                        else:
+                            common_method = file1_methods & file2_methods
+                        ratio_common_methods = len(common_method) / min(n_file1_methods, n_file2_methods)
                         if not ratio_common_methods > self.RATIO_FILE_COMMON_METHODS:
                             continue
 
@@ -87,6 +127,16 @@ class RepositoryComparator(Comparator):
             yield f, "added"
             f2_parsed.add(f)
 
+    def get_similar_name_lengths(self, length, names_by_length):
+        # the ratio of two strings is at most 2 * min(len1, len2) / (len1 + len2)
+        return [other_length for other_length in names_by_length
+                if 2 * min(length, other_length) / (length + other_length) > self.RATIO_FILE_NAMES_SIMILARITY - 1e-9]
+
+    @staticmethod
+    def get_method_names(file):
+        names = [m.name for m in file.methods]
+        return set(names), len(names)
+
     def compare_files(self):
         for file1, file2 in self.files_mapping:
             if isinstance(file2, str):
@@ -103,7 +153,7 @@ class RepositoryComparator(Comparator):
                     ]
                 }
             else:
-                comparator = PythonFileComparator(file1, file2)
+                comparator = PythonFileComparator(file1, file2, scorer=self.scorer, line_diff=self.line_diff)
                 yield {
                     **file2.to_dict(),
                     "mapping": file2.to_dict()["id"],
@@ -112,9 +162,12 @@ class RepositoryComparator(Comparator):
                 }
 
     def get_initial_release_data(self):
-        data = []
+        return list(self.iter_initial_release_data())
+
+    def iter_initial_release_data(self):
+        self.sort_compared_function_calls()
         for file in self.repo1.files:
-            data.append({
+            yield {
                 **file.to_dict(),
                 "imports": [i.content for i in file.imports],
                 "methods": [
@@ -124,55 +177,99 @@ class RepositoryComparator(Comparator):
                     }
                     for m in file.methods
                 ]
-            })
-        return data
+            }
+
+    def sort_compared_function_calls(self):
+        # the initial release used to be written once the files were compared, the function calls of the methods
+        # mapped to a method of the next release were then sorted by offset. Keep the same output.
+        for file1, file2 in self.files_mapping:
+            if isinstance(file2, str):
+                continue
+            for m1, m2 in PythonFileComparator(file1, file2, compare=False).methods_mapping:
+                if not isinstance(m2, str):
+                    m1.sort_fc_calls_by_start_offset()
 
 
 class PythonFileComparator(Comparator):
-    def __init__(self, file1: PythonFile, file2: PythonFile):
+    def __init__(self, file1: PythonFile, file2: PythonFile, compare=True, scorer: Scorer = None, line_diff=False):
         self.file1 = file1
         self.file2 = file2
+        self.scorer = scorer if scorer is not None else DEFAULT_SCORER
+        # with `line_diff`, the mapped methods also have the line ranges that changed (see `line_diff.py`)
+        self.line_diff = line_diff
 
-        self.methods_mapping = list(self.map_methods())
-        self.methods_data = list(self.get_methods_data())
+        if file1.content_hash is not None and file1.content_hash == file2.content_hash:
+            self.methods_mapping = list(self.map_unchanged_methods())
+        else:
+            self.methods_mapping = list(self.map_methods())
+        # without `compare`, only the methods are mapped
+        self.methods_data = list(self.get_methods_data()) if compare else None
 
     def map_methods(self):
         m1_parsed = set()
         m2_parsed = set()
 
+        # methods of the new release indexed by (class_name, name, params) and by (class_name, name)
+        methods2 = {}
+        methods2_by_name = defaultdict(deque)
+        for method2 in self.file2.methods:
+            methods2.setdefault(method2.get_signature(), method2)
+            methods2_by_name[method2.class_name, method2.name].append(method2)
+
         for method1 in self.file1.methods:
-            if method1 in m1_parsed:
+            signature = method1.get_signature()
+            if signature in m1_parsed:
                 continue
             # check for exact match (class_name, name and params) between both methods
-            for method2 in self.file2.methods:
-                if method2 in m2_parsed:
-                    continue
-                if method1 == method2:
-                    yield method1, method2
-                    m1_parsed.add(method1)
-                    m2_parsed.add(method2)
-                    break
+            method2 = methods2.get(signature)
+            if method2 is not None and signature not in m2_parsed:
+                yield method1, method2
+                m1_parsed.add(signature)
+                m2_parsed.add(signature)
 
             # check for partial match (class_name, name) --> handle the case where params change
-            if method1 not in m1_parsed:
-                file2_methods_filtered = [m2 for m2 in self.file2.methods if m2 not in m2_parsed]
-                for method2 in file2_methods_filtered:
-                    if method1.partial_eq(method2):
-                        yield method1, method2
-                        break
+            if signature not in m1_parsed:
+                candidates = methods2_by_name.get((method1.class_name, method1.name))
+                # methods matched exactly are never candidates again
+                while candidates and candidates[0].get_signature() in m2_parsed:
+                    candidates.popleft()
+                if candidates:
+                    yield method1, candidates[0]
 
             # method removed in the new release
-            if method1 not in m1_parsed:
+            if signature not in m1_parsed:
                 yield method1, "removed"
 
         # new methods in the new release of the repository
-        new_methods = [m2 for m2 in self.file2.methods if m2 not in m2_parsed]
+        new_methods = [m2 for m2 in self.file2.methods if m2.get_signature() not in m2_parsed]
         for m in new_methods:
             yield m, "added"
-            m2_parsed.add(m)
+            m2_parsed.add(m.get_signature())
+
+    def map_unchanged_methods(self):
+        # files with identical contents: the first method with a given signature is mapped to its counterpart,
+        # the same mapping as `map_methods` without any lookup
+        signatures = set()
+        for method1, method2 in zip(self.file1.methods, self.file2.methods):
+            signature = method1.get_signature()
+            if signature not in signatures:
+                signatures.add(signature)
+                yield method1, method2
 
     def get_methods_data(self):
+        # the contents of the changed methods and the expressions of their mapped function calls are scored at once
+        comparators = []
+        pairs = []
         for m1, m2 in self.methods_mapping:
+            comparator = None
+            if not isinstance(m2, str) and not (m1.content_hash is not None and m1.content_hash == m2.content_hash):
+                comparator = MethodComparator(m1, m2, self.scorer, compare=False)
+                pairs.append((m1.content, m2.content))
+                pairs.extend(comparator.get_expression_pairs())
+            comparators.append(comparator)
+        scores = iter(self.scorer.score_pairs(pairs))
+
+        for (m1, m2), comparator in zip(self.methods_mapping, comparators):
             if isinstance(m2, str):
                 yield {
                     **m1.to_dict(),
@@ -184,77 +281,119 @@ class PythonFileComparator(Comparator):
                         for fc in m1.function_calls
                     ]
                 }
+            elif comparator is None:
+                yield {
+                    **m2.to_dict(),
+                    "mapping": m1.to_dict()["id"],
+                    "function_calls": MethodComparator.get_unchanged_function_calls_data(m1, m2),
+                    "statistics": {
+                        "ratio": 1.0,
+                        "dist": 0
+                    },
+                    **self.get_line_diff_data(m1, m2, unchanged=True)
+                }
             else:
-                comparator = MethodComparator(m1, m2)
-                ratio, distance = self.levenshtein_ratio_and_distance(m1.content, m2.content)
+                ratio, distance = next(scores)
                 yield {
                     **m2.to_dict(),
                     "mapping": m1.to_dict()["id"],
-                    "function_calls": comparator.fc_data,
+                    "function_calls": comparator.get_function_calls_data(scores),
                     "statistics": {
                         "ratio": ratio,
                         "dist": distance
-                    }
+                    },
+                    **self.get_line_diff_data(m1, m2)
                 }
 
+    def get_line_diff_data(self, method1, method2, unchanged=False):
+        if not self.line_diff:
+            return {}
+        if unchanged:
+            return {"line_diff": {"added_lines": 0, "removed_lines": 0, "hunks": []}}
+        return {"line_diff": get_line_diff(method1.content, method2.content)}
+
 
 class MethodComparator(Comparator):
-    def __init__(self, method1: Method, method2: Method):
+    def __init__(self, method1: Method, method2: Method, scorer: Scorer = None, compare=True):
         self.method1 = method1
         self.method2 = method2
+        self.scorer = scorer if scorer is not None else DEFAULT_SCORER
 
         self.fc_mapping = list(self.map_function_calls())
-        self.fc_data = list(self.get_function_calls_data())
+        # without `compare`, only the function calls are mapped
+        self.fc_data = self.get_function_calls_data() if compare else None
 
     def map_function_calls(self):
         self.method1.sort_fc_calls_by_start_offset()
         self.method2.sort_fc_calls_by_start_offset()
-        fcs1_parsed = set()
+        # function calls are created on access, they are only retrieved once
+        fcs1 = self.method1.function_calls
+        fcs2 = self.method2.function_calls
+
+        # positions of the function calls of the new method, indexed by (context, name)
+        fcs2_positions = defaultdict(deque)
+        for j, fc2 in enumerate(fcs2):
+            fcs2_positions[fc2.context, fc2.name].append(j)
         fcs2_parsed = set()
 
-        for i, fc1 in enumerate(self.method1.function_calls):
-            if (i, fc1) in fcs1_parsed:
-                continue
-            for j, fc2 in enumerate(self.method2.function_calls):
-                if (j, fc2) in fcs2_parsed:
-                    continue
-
-                # fcs are identical and have the same start/end offsets -> most-likely no change.
-                if fc1 == fc2:
-                    yield fc1, fc2
-                    fcs1_parsed.add((i, fc1))
-                    fcs2_parsed.add((j, fc2))
-                    break
-
-                # fcs are similar (e.g., np.mean == np.mean), but different offsets.
-                elif fc1.context == fc2.context and fc1.name == fc2.name:
-                    yield fc1, fc2
-                    fcs1_parsed.add((i, fc1))
-                    fcs2_parsed.add((j, fc2))
-                    break
-
-            if (i, fc1) not in fcs1_parsed:
+        for fc1 in fcs1:
+            # identical fcs (same expression and offsets) share their context and name, so the first fc that is not
+            # mapped yet with the same context and name is either identical (most-likely no change) or similar
+            # (e.g., np.mean == np.mean), but with different offsets.
+            positions = fcs2_positions.get((fc1.context, fc1.name))
+            if positions:
+                j = positions.popleft()
+                yield fc1, fcs2[j]
+                fcs2_parsed.add(j)
+            else:
                 yield fc1, "removed"
-                fcs1_parsed.add((i, fc1))
 
-        for j, fc in enumerate(self.method2.function_calls):
-            if (j, fc) not in fcs2_parsed:
+        for j, fc in enumerate(fcs2):
+            if j not in fcs2_parsed:
                 yield fc, "added"
 
-    def get_function_calls_data(self):
+    @staticmethod
+    def get_unchanged_function_calls_data(method1, method2):
+        # methods with identical contents: each fc is mapped to the fc at the same position
+        method1.sort_fc_calls_by_start_offset()
+        method2.sort_fc_calls_by_start_offset()
+        return [
+            {
+                **fc2.to_dict(),
+                "mapping": fc1.to_dict()["id"],
+                "statistics": {
+                    "ratio": 1.0,
+                    "dist": 0
+                }
+            }
+            for fc1, fc2 in zip(method1.function_calls, method2.function_calls)
+        ]
+
+    def get_expression_pairs(self):
+        return [(fc1.expression, fc2.expression) for fc1, fc2 in self.fc_mapping if not isinstance(fc2, str)]
+
+    def get_function_calls_data(self, scores=None):
+        """
+        `scores` is an iterator over the statistics of the expression pairs (see `get_expression_pairs`), they are
+        scored in one batch if not given.
+        """
+        if scores is None:
+            scores = iter(self.scorer.score_pairs(self.get_expression_pairs()))
+        fc_data = []
         for fc1, fc2 in self.fc_mapping:
             if isinstance(fc2, str):
-                yield {
+                fc_data.append({
                     **fc1.to_dict(),
                     "mapping": fc2
-                }
+                })
             else:
-                ratio, distance = self.levenshtein_ratio_and_distance(fc1.expression, fc2.expression)
-                yield {
+                ratio, distance = next(scores)
+                fc_data.append({
                     **fc2.to_dict(),
                     "mapping": fc1.to_dict()["id"],
                     "statistics": {
                         "ratio": ratio,
                         "dist": distance
                     }
-                }
+                })
+        return fc_data
@@ -1,13 +1,22 @@
 import argparse
-import json
 import logging
+import multiprocessing
 import os
 import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
 
 import pandas as pd
+from tqdm import tqdm
 
 from code_change_comparators import RepositoryComparator
-from .parser import Repository
+from manifest import Manifest
+from parquet_export import ParquetTablesWriter
+from parse_cache import ParseCache
+from parser import ID_SCHEME, Repository
+from scoring import Scorer
+from writers import JSON_ENCODERS, JsonlWriter
 
 tqdm_kwargs = {
     'bar_format': '{l_bar}{bar:100}{r_bar}{bar:-10b}',
@@ -15,11 +24,245 @@ tqdm_kwargs = {
 }
 
 
+class ReleasePipeline:
+    """
+    Iterates over the pairs of contiguous releases of a repository, parsing each release exactly once.
+    With `prefetch`, the next release is parsed in the background while the current pair is compared.
+    The first `start` pairs are skipped (e.g., already compared in a previous run).
+    """
+    def __init__(self, release_dirs, parse_release=Repository, prefetch=True, start=0):
+        self.release_dirs = release_dirs
+        self.parse_release = parse_release
+        self.prefetch = prefetch
+        self.start = start
+
+    def get_release_pairs(self):
+        # a release is only compared to the next one if its directory exists
+        return [(i, i + 1) for i, release_dir in enumerate(self.release_dirs[:-1]) if os.path.exists(release_dir)]
+
+    def iter_parsed_releases(self, indices):
+        if not self.prefetch:
+            for index in indices:
+                yield index, self.parse_release(self.release_dirs[index])
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            futures = deque()
+            for index in indices:
+                futures.append((index, executor.submit(self.parse_release, self.release_dirs[index])))
+                # keep one release being parsed ahead of the one handed out
+                if len(futures) > 1:
+                    parsed_index, future = futures.popleft()
+                    yield parsed_index, future.result()
+            while futures:
+                parsed_index, future = futures.popleft()
+                yield parsed_index, future.result()
+
+    def __iter__(self):
+        pairs = self.get_release_pairs()[self.start:]
+        indices = sorted({index for pair in pairs for index in pair})
+        parsed_releases = self.iter_parsed_releases(indices)
+
+        repositories = {}
+        for i, j in pairs:
+            for index in (i, j):
+                while index not in repositories:
+                    parsed_index, repository = next(parsed_releases)
+                    repositories[parsed_index] = repository
+
+            yield i, j, repositories[i], repositories[j]
+
+            # comparisons sort function calls in place, restore them before the release is compared again
+            repositories[j].restore_function_calls_order()
+            # only the most recent release is kept in memory
+            for index in [index for index in repositories if index < j]:
+                del repositories[index]
+
+
+def get_release_metadata(row):
+    metadata = {k: v for k, v in row.items() if k != 'repository_name'}
+    metadata['date'] = str(metadata['date'])
+    return metadata
+
+
+def get_releases(repo_df, data_dir):
+    repository_name = str(repo_df['repository_name'].iloc[0])
+    releases = [get_release_metadata(row) for row in repo_df.to_dict('records')]
+    release_dirs = [os.path.join(data_dir, repository_name, row['branch']) for row in releases]
+    return repository_name, releases, release_dirs
+
+
+def read_download_data(download_data_fp):
+    """
+    Reads the releases of `download_data.csv`, returns a list of dataframes (one per repository) of the releases in
+    chronological order.
+    """
+    metadata_df = pd.read_csv(download_data_fp)
+
+    # convert to get identical naming conventions used in the data directory
+    metadata_df['repository_name'] = metadata_df['repository'].apply(
+        lambda v: v.split('/')[-1] if 'github' in v else v.split('/')[-2])
+    metadata_df['branch'] = metadata_df['branch'].apply(lambda v: v.replace('/', '-'))
+    metadata_df['date'] = pd.to_datetime(metadata_df['date'], utc=True)
+    metadata_df = metadata_df.drop(['download_link', 'name'], axis=1)
+    # releases are compared in chronological order
+    metadata_df = metadata_df.sort_values(['repository_name', 'date'], kind='stable')
+
+    # split dataframe in a list of dataframe (one per repository)
+    return [group.reset_index(drop=True) for _, group in metadata_df.groupby('repository_name')]
+
+
+def process_repository(repo_df, data_dir, output_dir, cache=None, pool=None, num_workers=0, progress=None,
+                       show_progress=True, compression=None, json_encoder='json', output_format='jsonl', resume=True,
+                       scorer=None, line_diff=False):
+    repository_name, releases, release_dirs = get_releases(repo_df, data_dir)
+    for release_dir in release_dirs:
+        if not os.path.exists(release_dir):
+            logging.info(f'Release directory does not exist: {release_dir}')
+
+    # pairs already written by a previous run with identical releases are not compared again
+    # outputs written with other ids (e.g., process-dependent hashes) cannot be resumed
+    settings = {
+        'output_format': output_format,
+        'compression': compression,
+        'json_encoder': json_encoder,
+        'id_scheme': ID_SCHEME
+    }
+    # the statistics are only cut off with a configured scorer
+    if scorer is not None and scorer.has_cutoffs():
+        settings['scoring'] = scorer.cutoffs
+    if line_diff:
+        settings['line_diff'] = True
+    manifest = Manifest(f'{output_dir}/{repository_name}.manifest.json', settings)
+    if resume:
+        manifest.load()
+    # releases whose files did not change since the previous run are not hashed again
+    release_hashes = [manifest.hash_release(release_dir, release)
+                      for release_dir, release in zip(release_dirs, releases)]
+    pairs = [{
+        'prev_branch': releases[i]['branch'],
+        'branch': releases[j]['branch'],
+        'prev_hash': release_hashes[i],
+        'hash': release_hashes[j]
+    } for i, j in ReleasePipeline(release_dirs).get_release_pairs()]
+    n_done, position = manifest.get_checkpoint(pairs)
+    manifest.truncate(n_done)
+    if progress is not None and n_done > 0:
+        progress.put(n_done)
+    if n_done > 0:
+        logging.info(f'Resuming `{repository_name}` after {n_done}/{len(pairs)} release pairs')
+    if n_done == len(pairs) and position is not None:
+        return
+
+    parse_release = partial(Repository, num_workers=num_workers, cache=cache, pool=pool, show_progress=show_progress)
+    # parsing the next release in the background only helps when files are parsed by worker processes
+    pipeline = ReleasePipeline(release_dirs, parse_release=parse_release, prefetch=num_workers > 0, start=n_done)
+    # records are written as soon as they are produced
+    if output_format == 'parquet':
+        writer = ParquetTablesWriter(output_dir, repository_name, compression, position=position)
+    else:
+        writer = JsonlWriter(f'{output_dir}/{repository_name}.jsonl', compression, json_encoder, position=position)
+    with writer:
+        for i, j, repository1, repository2 in pipeline:
+            logging.info(f'Comparing `{release_dirs[i]}` and `{release_dirs[j]}`')
+            comparator = RepositoryComparator(repository1, repository2, scorer, line_diff)
+
+            # initial release of the repository
+            if i == 0:
+                for entry in comparator.iter_initial_release_data():
+                    writer.write({
+                        **releases[i],
+                        "prev_branch": None,
+                        **entry
+                    })
+
+            for entry in comparator.files_data:
+                writer.write({
+                    **releases[j],
+                    "prev_branch": releases[i]["branch"],
+                    **entry
+                })
+
+            manifest.add(pairs[len(manifest.pairs)], writer.checkpoint())
+            if progress is not None:
+                progress.put(1)
+
+
+def process_repositories(df_list, data_dir, output_dir, cache=None, repository_workers=os.cpu_count(),
+                         compression=None, json_encoder='json', output_format='jsonl', resume=True, scorer=None,
+                         line_diff=False):
+    """
+    Processes many repositories concurrently, one process per repository. The releases of a repository are
+    still compared sequentially, and its files are parsed serially.
+    """
+    # the longest release chains are started first so that they do not run alone at the end
+    n_pairs = [len(ReleasePipeline(get_releases(repo_df, data_dir)[2]).get_release_pairs()) for repo_df in df_list]
+    order = sorted(range(len(df_list)), key=lambda i: n_pairs[i], reverse=True)
+
+    # the manager server process is shut down once all the repositories are processed
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(repository_workers) as executor, \
+            tqdm(total=sum(n_pairs), desc='Comparing releases', **tqdm_kwargs) as progress_bar:
+        progress = manager.Queue()
+        futures = {}
+        for i in order:
+            repository_name = str(df_list[i]['repository_name'].iloc[0])
+            future = executor.submit(process_repository, df_list[i], data_dir, output_dir, cache,
+                                     progress=progress, show_progress=False, compression=compression,
+                                     json_encoder=json_encoder, output_format=output_format, resume=resume,
+                                     scorer=scorer, line_diff=line_diff)
+            futures[future] = repository_name
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            while not progress.empty():
+                progress_bar.update(progress.get())
+            for future in done:
+                try:
+                    future.result()
+                    logging.info(f'Done extracting data from `{futures[future]}`')
+                except Exception:
+                    logging.exception(f'Could not extract data from `{futures[future]}`')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_dir', type=str, default=None)
     parser.add_argument('--download_data_fp', type=str, default=None)
     parser.add_argument('--output_dir', type=str, default=None)
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Directory of the parse cache shared across releases and runs (disabled if not set).')
+    parser.add_argument('--cache_size', type=float, default=10,
+                        help='Maximum size of the parse cache in GB.')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(),
+                        help='Number of processes parsing .py files, shared by all releases (0 to parse serially).')
+    parser.add_argument('--repository_workers', type=int, default=1,
+                        help='Number of repositories processed concurrently. With more than one, each repository is '
+                             'processed in its own process and `--num_workers` is ignored: files are parsed '
+                             'serially, so a large repository becomes the long tail of the run.')
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'zstd'],
+                        help='Compression of the output .jsonl files (zstd requires the `zstandard` package).')
+    parser.add_argument('--output_format', type=str, default='jsonl', choices=['jsonl', 'parquet'],
+                        help='`parquet` writes normalised tables (files, methods, function_calls and imports) '
+                             'instead of nested records, see `parquet_export.py`.')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Generate all the release pairs again, instead of resuming from the pairs written by '
+                             'a previous run (see `manifest.py`).')
+    parser.add_argument('--json_encoder', type=str, default='json', choices=list(JSON_ENCODERS),
+                        help='Encoder of the output records, `orjson` is faster but writes compact JSON.')
+    parser.add_argument('--min_length_ratio', type=float, default=None,
+                        help='Methods and function calls whose shortest content is shorter than this ratio of the '
+                             'longest are not scored (null statistics).')
+    parser.add_argument('--ratio_cutoff', type=float, default=None,
+                        help='Methods and function calls with a lower Levenshtein ratio are not scored.')
+    parser.add_argument('--max_distance', type=int, default=None,
+                        help='Methods and function calls with a higher Levenshtein distance are not scored.')
+    parser.add_argument('--scoring_workers', type=int, default=1,
+                        help='Number of threads scoring the methods and function calls of a file (-1 for all the '
+                             'CPUs, requires `numpy` and `rapidfuzz`).')
+    parser.add_argument('--line_diff', action='store_true',
+                        help='Add the numbers of added and removed lines, and the changed line ranges, of the mapped '
+                             'methods (see `line_diff.py`).')
     args = parser.parse_args()
 
     logging.basicConfig(
@@ -32,59 +275,36 @@ if __name__ == '__main__':
     )
 
     os.makedirs(args.output_dir, exist_ok=True)
-    metadata_df = pd.read_csv(args.download_data_fp)
-
-    # convert to get identical naming conventions used in the data directory
-    metadata_df['repository_name'] = metadata_df['repository'].apply(
-        lambda v: v.split('/')[-1] if 'github' in v else v.split('/')[-2])
-    metadata_df['branch'] = metadata_df['branch'].apply(lambda v: v.replace('/', '-'))
-    metadata_df['date'] = pd.to_datetime(metadata_df['date'], utc=True)
-    metadata_df = metadata_df.drop(['download_link', 'name'], axis=1)
+    scorer = Scorer(args.min_length_ratio, args.ratio_cutoff, args.max_distance, args.scoring_workers)
+    cache = None
+    if args.cache_dir is not None:
+        cache = ParseCache(os.path.join(args.cache_dir, 'parse_cache.sqlite'), max_size=int(args.cache_size * 1024 ** 3))
 
-    # split dataframe in a list of dataframe (one per repository)
-    df_list = [group.reset_index(drop=True) for _, group in metadata_df.groupby('repository_name')]
+    df_list = read_download_data(args.download_data_fp)
 
+    existing_df_list = []
     for repo_df in df_list:
         repository_name = str(repo_df['repository_name'].iloc[0])
         repository_dir = os.path.join(args.data_dir, repository_name)
         if not os.path.exists(repository_dir):
             logging.info(f'Repository directory does not exist: {repository_dir}')
             continue
+        existing_df_list.append(repo_df)
 
-        logging.info(f'Extracting data from `{repository_name}`')
-        with open(f'{args.output_dir}/{repository_name}.jsonl', 'w') as fout:
-            for index, row in repo_df.iterrows():
-                release_dir_current = os.path.join(args.data_dir, row['repository_name'], row['branch'])
-                if not os.path.exists(release_dir_current):
-                    logging.info(f'Release directory does not exist: {release_dir_current}')
-                    continue
-
-                row["date"] = str(row["date"])
-                if index + 1 < len(repo_df):
-                    next_row = repo_df.iloc[index + 1].copy()
-                    release_dir_next = os.path.join(args.data_dir, next_row['repository_name'], next_row['branch'])
-                    next_row["date"] = str(next_row["date"])
-
-                    logging.info(f'Parsing `{release_dir_current}` and `{release_dir_next}`')
-                    repository1 = Repository(release_dir_current)
-                    repository2 = Repository(release_dir_next)
-                    logging.info(f'Comparing `{release_dir_current}` and `{release_dir_next}`')
-                    comparator = RepositoryComparator(repository1, repository2)
-
-                    del row['repository_name'], next_row['repository_name']
-                    # initial release of the repository
-                    if index == 0:
-                        initial_data = comparator.get_initial_release_data()
-                        for entry in initial_data:
-                            fout.write(json.dumps({
-                                **row.to_dict(),
-                                "prev_branch": None,
-                                **entry
-                            }) + '\n')
-
-                    for entry in comparator.files_data:
-                        fout.write(json.dumps({
-                            **next_row.to_dict(),
-                            "prev_branch": row["branch"],
-                            **entry
-                        }) + '\n')
+    if args.repository_workers > 1:
+        process_repositories(existing_df_list, args.data_dir, args.output_dir, cache, args.repository_workers,
+                             args.compression, args.json_encoder, args.output_format, not args.overwrite, scorer,
+                             args.line_diff)
+    else:
+        pool = multiprocessing.Pool(args.num_workers) if args.num_workers > 0 else None
+        try:
+            for repo_df in existing_df_list:
+                logging.info(f'Extracting data from `{repo_df["repository_name"].iloc[0]}`')
+                process_repository(repo_df, args.data_dir, args.output_dir, cache, pool, args.num_workers,
+                                   compression=args.compression, json_encoder=args.json_encoder,
+                                   output_format=args.output_format, resume=not args.overwrite, scorer=scorer,
+                                   line_diff=args.line_diff)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
@@ -0,0 +1,162 @@
+def get_lines(content):
+    # same lines as the `LOC`s of a method (stripped, indentation changes are not reported), the index of a line is
+    # its `line_number`
+    return [line.strip() for line in content.split('\n')]
+
+
+def get_line_ids(lines, ids):
+    # each distinct line is hashed once, lines are then compared as integers
+    return [ids.setdefault(line, len(ids)) for line in lines]
+
+
+def find_middle_snake(a, a_start, a_end, b, b_start, b_end):
+    """
+    Finds the middle snake of a shortest edit script of a[a_start:a_end] into b[b_start:b_end], searching from both
+    ends at once (linear-space variant of Myers' O(ND) diff algorithm). Returns the start and end (x, y) of the
+    snake, relative to (a_start, b_start).
+    """
+    n = a_end - a_start
+    m = b_end - b_start
+    delta = n - m
+    odd = delta % 2 == 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    # furthest x reached on each diagonal k = x - y, forward and backward (diagonals of the reversed sequences)
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_start + x] == b[b_start + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            # the backward diagonal of the same points is delta - k
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                return (x_start, y_start), (x, y)
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_end - 1 - x] == b[b_end - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return (n - x, m - y), (n - x_start, m - y_start)
+    raise AssertionError('No middle snake found')
+
+
+def get_matching_blocks(a, b):
+    """
+    Returns the blocks of equal elements (a_start, b_start, length) of a longest common subsequence of `a` and `b`,
+    in order.
+    """
+    # elements that appear in only one sequence are not part of any common subsequence: they are discarded before
+    # the search (as difflib and GNU diff do), so that rewritten methods only search the few lines they still share
+    common = set(a).intersection(b)
+    if not common:
+        return []
+    a_indexes = [i for i, element in enumerate(a) if element in common]
+    b_indexes = [j for j, element in enumerate(b) if element in common]
+    blocks = []
+    for x, y, length in find_matching_blocks([a[i] for i in a_indexes], [b[j] for j in b_indexes]):
+        for k in range(length):
+            i, j = a_indexes[x + k], b_indexes[y + k]
+            # blocks of the discarded sequences are split where discarded elements were
+            if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+                blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + 1)
+            else:
+                blocks.append((i, j, 1))
+    return blocks
+
+
+def find_matching_blocks(a, b):
+    # blocks of a longest common subsequence of `a` and `b`, found with the middle snakes of their edit script
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_start, a_end, b_start, b_end = stack.pop()
+        # common prefix and suffix
+        length = 0
+        while a_start + length < a_end and b_start + length < b_end and a[a_start + length] == b[b_start + length]:
+            length += 1
+        if length:
+            blocks.append((a_start, b_start, length))
+            a_start += length
+            b_start += length
+        length = 0
+        while a_end - length > a_start and b_end - length > b_start and a[a_end - 1 - length] == b[b_end - 1 - length]:
+            length += 1
+        if length:
+            a_end -= length
+            b_end -= length
+            blocks.append((a_end, b_end, length))
+        if a_start == a_end or b_start == b_end:
+            continue
+
+        (x, y), (u, v) = find_middle_snake(a, a_start, a_end, b, b_start, b_end)
+        if u > x:
+            blocks.append((a_start + x, b_start + y, u - x))
+        stack.append((a_start, a_start + x, b_start, b_start + y))
+        stack.append((a_start + u, a_end, b_start + v, b_end))
+    return sorted(blocks)
+
+
+def get_hunks(lines1, lines2):
+    """
+    Line ranges that differ between `lines1` and `lines2`: (prev_start, prev_end, start, end), where
+    lines1[prev_start:prev_end] are replaced by lines2[start:end].
+    """
+    ids = {}
+    a = get_line_ids(lines1, ids)
+    b = get_line_ids(lines2, ids)
+    hunks = []
+    i = j = 0
+    for a_start, b_start, length in get_matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if a_start > i or b_start > j:
+            hunks.append((i, a_start, j, b_start))
+        i = a_start + length
+        j = b_start + length
+    return hunks
+
+
+def get_line_diff(content1, content2):
+    """
+    Line-level changes from the method `content1` to `content2`: numbers of added and removed lines, and the
+    `added`, `removed` or `modified` hunks with their line ranges ([start, end) line numbers).
+    """
+    hunks = []
+    added_lines = 0
+    removed_lines = 0
+    for prev_start, prev_end, start, end in get_hunks(get_lines(content1), get_lines(content2)):
+        if prev_start == prev_end:
+            hunk_type = 'added'
+        elif start == end:
+            hunk_type = 'removed'
+        else:
+            hunk_type = 'modified'
+        hunks.append({
+            'type': hunk_type,
+            'prev_start': prev_start,
+            'prev_end': prev_end,
+            'start': start,
+            'end': end
+        })
+        added_lines += end - start
+        removed_lines += prev_end - prev_start
+    return {
+        'added_lines': added_lines,
+        'removed_lines': removed_lines,
+        'hunks': hunks
+    }
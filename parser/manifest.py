@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+
+# bump when the output of the generator changes, outputs written by another version are generated again
+GENERATOR_VERSION = 1
+
+# files of a release used by the generator
+RELEASE_FILE_SUFFIXES = ('.py', '.txt', '.tar', '.tar.gz')
+
+
+def iter_release_files(release_dir):
+    # files of a release used by the generator, in a deterministic order
+    for root, dirs, files in os.walk(release_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(RELEASE_FILE_SUFFIXES):
+                yield os.path.join(root, name)
+
+
+def get_release_fingerprint(release_dir, metadata=None):
+    """
+    Cheap fingerprint of a release: the paths, sizes and modification times of its files, along with the release
+    metadata. Returns None if the release directory does not exist.
+    """
+    if not os.path.exists(release_dir):
+        return None
+    fingerprint = hashlib.blake2b(digest_size=20)
+    fingerprint.update(json.dumps(metadata, sort_keys=True).encode('utf-8'))
+    for path in iter_release_files(release_dir):
+        stat = os.stat(path)
+        fingerprint.update(os.path.relpath(path, release_dir).encode('utf-8', errors='surrogateescape') + b'\0')
+        fingerprint.update(f'{stat.st_size}:{stat.st_mtime_ns}\0'.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def hash_release(release_dir, metadata=None):
+    """
+    Hashes the content of the files of a release used by the generator (.py files, requirements and archives),
+    along with the release metadata. Returns None if the release directory does not exist.
+    """
+    if not os.path.exists(release_dir):
+        return None
+    release_hash = hashlib.blake2b(digest_size=20)
+    release_hash.update(json.dumps(metadata, sort_keys=True).encode('utf-8'))
+    for path in iter_release_files(release_dir):
+        release_hash.update(os.path.relpath(path, release_dir).encode('utf-8', errors='surrogateescape') + b'\0')
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 ** 2), b''):
+                release_hash.update(chunk)
+        release_hash.update(b'\0')
+    return release_hash.hexdigest()
+
+
+class Manifest:
+    """
+    Checkpoints of the output of a repository: the release pairs that were fully written, in order, with the hashes
+    of both releases and the position of the output after each pair (see the `checkpoint` method of the writers).
+    The manifest is only valid for outputs written with the same generator version and `settings`.
+    The hashes of the releases are also kept by fingerprint (see `get_release_fingerprint`), so that the releases
+    are only hashed again when their files changed.
+    """
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.settings = {'generator_version': GENERATOR_VERSION, **(settings or {})}
+        self.pairs = []
+        # release hashes by fingerprint, of the previous run and of the releases hashed by this run
+        self.previous_release_hashes = {}
+        self.release_hashes = {}
+
+    def load(self):
+        self.pairs = []
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return self
+        if data.get('settings') == self.settings:
+            self.pairs = data.get('pairs', [])
+        self.previous_release_hashes = data.get('release_hashes', {})
+        return self
+
+    def save(self):
+        # written to a temporary file first so that the manifest is never left half-written
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'settings': self.settings, 'pairs': self.pairs, 'release_hashes': self.release_hashes},
+                      file, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def hash_release(self, release_dir, metadata=None):
+        """
+        Returns the hash of a release (see `hash_release`), only computed if the fingerprint of the release is not
+        the one of a release hashed by the previous run.
+        """
+        fingerprint = get_release_fingerprint(release_dir, metadata)
+        if fingerprint is None:
+            return None
+        if fingerprint not in self.release_hashes:
+            release_hash = self.previous_release_hashes.get(fingerprint)
+            self.release_hashes[fingerprint] = release_hash or hash_release(release_dir, metadata)
+        return self.release_hashes[fingerprint]
+
+    def get_checkpoint(self, pairs):
+        """
+        Returns the number of leading `pairs` (dicts with the branches and hashes of both releases) that were
+        already written, and the position of the output after them (None if nothing can be kept).
+        """
+        n_done = 0
+        position = None
+        for pair, entry in zip(pairs, self.pairs):
+            if any(entry.get(key) != value for key, value in pair.items()):
+                break
+            n_done += 1
+            position = entry['position']
+        return n_done, position
+
+    def truncate(self, n_pairs):
+        self.pairs = self.pairs[:n_pairs]
+        self.save()
+
+    def add(self, pair, position):
+        self.pairs.append({**pair, 'position': position})
+        self.save()
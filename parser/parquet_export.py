@@ -0,0 +1,290 @@
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def get_schemas():
+    """
+    Normalised tables of the CodeLL schema. Rows are joined on (repository, branch, file_id), then `method_index`
+    and `call_index` (positions in the lists of the .jsonl records), as ids are not unique across releases.
+    `mapping` holds the id of the entity in the release `prev_branch`, or `added`/`removed`.
+    """
+    release_fields = [
+        ('repository', pa.string()),
+        ('branch', pa.string()),
+        ('date', pa.timestamp('us', tz='UTC')),
+        ('prev_branch', pa.string()),
+    ]
+    statistics_fields = [
+        ('ratio', pa.float64()),
+        ('dist', pa.int64()),
+    ]
+    # only generated with `--line_diff`
+    line_diff_fields = [
+        ('added_lines', pa.int64()),
+        ('removed_lines', pa.int64()),
+        ('hunks', pa.list_(pa.struct([
+            ('type', pa.string()),
+            ('prev_start', pa.int64()),
+            ('prev_end', pa.int64()),
+            ('start', pa.int64()),
+            ('end', pa.int64()),
+        ]))),
+    ]
+    return {
+        'files': pa.schema(release_fields + [
+            ('file_id', pa.string()),
+            ('path', pa.string()),
+            ('mapping', pa.string()),
+            ('n_methods', pa.int32()),
+            ('n_imports', pa.int32()),
+        ]),
+        'imports': pa.schema(release_fields[:2] + [
+            ('file_id', pa.string()),
+            ('import_index', pa.int32()),
+            ('content', pa.string()),
+        ]),
+        'methods': pa.schema(release_fields[:2] + [
+            ('file_id', pa.string()),
+            ('method_index', pa.int32()),
+            ('method_id', pa.string()),
+            ('class', pa.string()),
+            ('name', pa.string()),
+            ('params', pa.list_(pa.string())),
+            ('content', pa.string()),
+            ('mapping', pa.string()),
+        ] + statistics_fields + line_diff_fields),
+        'function_calls': pa.schema(release_fields[:2] + [
+            ('file_id', pa.string()),
+            ('method_index', pa.int32()),
+            ('call_index', pa.int32()),
+            ('call_id', pa.string()),
+            ('name', pa.string()),
+            ('context', pa.string()),
+            ('expression', pa.string()),
+            ('start_offset', pa.int64()),
+            ('end_offset', pa.int64()),
+            ('lineno', pa.int64()),
+            ('mapping', pa.string()),
+        ] + statistics_fields),
+    }
+
+
+class ParquetTablesWriter:
+    """
+    Writes the records of a repository (see `code_change_data_generator.py`) as normalised Parquet tables,
+    in part files `{output_dir}/{table}/{repository_name}-{part}.parquet`. Each table directory can be read as a
+    single dataset, e.g., `pd.read_parquet(f'{output_dir}/function_calls')`. Rows are buffered and written by
+    row groups, and a part is only renamed to its final name once complete (see `checkpoint`).
+    With `position`, the first `position` parts of the repository are kept and the next ones are written again.
+    """
+    def __init__(self, output_dir, repository_name, compression=None, row_group_size=64 * 1024, position=None):
+        if pa is None:
+            raise ImportError('The Parquet export requires the `pyarrow` package')
+        self.output_dir = output_dir
+        self.repository_name = repository_name
+        # parquet default compression (snappy) unless specified
+        self.compression = compression or 'snappy'
+        self.row_group_size = row_group_size
+        self.schemas = get_schemas()
+        self.part = position or 0
+        self.rows = {table: [] for table in self.schemas}
+        self.writers = {}
+
+    def get_path(self, table, part):
+        return os.path.join(self.output_dir, table, f'{self.repository_name}-{part:05d}.parquet')
+
+    def get_part(self, file_name):
+        # part of a file of the repository, None for the files of other repositories
+        prefix = f'{self.repository_name}-'
+        for suffix in ('.parquet', '.parquet.tmp'):
+            if file_name.startswith(prefix) and file_name.endswith(suffix):
+                part = file_name[len(prefix):-len(suffix)]
+                if len(part) == 5 and part.isdigit():
+                    return int(part)
+        return None
+
+    def open(self):
+        # parts written after the position to resume from, and unfinished parts, are removed
+        for table in self.schemas:
+            table_dir = os.path.join(self.output_dir, table)
+            os.makedirs(table_dir, exist_ok=True)
+            for file_name in os.listdir(table_dir):
+                part = self.get_part(file_name)
+                if part is not None and (part >= self.part or file_name.endswith('.tmp')):
+                    os.remove(os.path.join(table_dir, file_name))
+        return self
+
+    def write(self, record):
+        release = {
+            'repository': record.get('repository'),
+            'branch': record.get('branch'),
+        }
+        file_id = record['id']
+        methods = record.get('methods', [])
+        imports = record.get('imports', [])
+
+        self.add_row('files', {
+            **release,
+            'date': parse_date(record.get('date')),
+            'prev_branch': record.get('prev_branch'),
+            'file_id': file_id,
+            'path': record['path'],
+            'mapping': record.get('mapping'),
+            'n_methods': len(methods),
+            'n_imports': len(imports),
+        })
+        for import_index, content in enumerate(imports):
+            self.add_row('imports', {
+                **release,
+                'file_id': file_id,
+                'import_index': import_index,
+                'content': content,
+            })
+        for method_index, method in enumerate(methods):
+            statistics = method.get('statistics') or {}
+            line_diff = method.get('line_diff') or {}
+            self.add_row('methods', {
+                **release,
+                'file_id': file_id,
+                'method_index': method_index,
+                'method_id': method['id'],
+                'class': method['class'],
+                'name': method['name'],
+                'params': method['params'],
+                'content': method['content'],
+                'mapping': method.get('mapping'),
+                'ratio': statistics.get('ratio'),
+                'dist': statistics.get('dist'),
+                'added_lines': line_diff.get('added_lines'),
+                'removed_lines': line_diff.get('removed_lines'),
+                'hunks': line_diff.get('hunks'),
+            })
+            for call_index, fc in enumerate(method['function_calls']):
+                statistics = fc.get('statistics') or {}
+                self.add_row('function_calls', {
+                    **release,
+                    'file_id': file_id,
+                    'method_index': method_index,
+                    'call_index': call_index,
+                    'call_id': fc['id'],
+                    'name': fc['name'],
+                    'context': fc['context'],
+                    'expression': fc['expression'],
+                    'start_offset': fc['start_offset'],
+                    'end_offset': fc['end_offset'],
+                    'lineno': fc['lineno'],
+                    'mapping': fc.get('mapping'),
+                    'ratio': statistics.get('ratio'),
+                    'dist': statistics.get('dist'),
+                })
+
+    def add_row(self, table, row):
+        rows = self.rows[table]
+        rows.append(row)
+        if len(rows) >= self.row_group_size:
+            self.flush_table(table)
+
+    def flush_table(self, table):
+        if self.rows[table]:
+            if table not in self.writers:
+                self.writers[table] = pq.ParquetWriter(f'{self.get_path(table, self.part)}.tmp',
+                                                       self.schemas[table], compression=self.compression)
+            self.writers[table].write_table(pa.Table.from_pylist(self.rows[table], schema=self.schemas[table]))
+            self.rows[table] = []
+
+    def checkpoint(self):
+        """
+        Completes the current part and returns the number of parts written, the position to resume from.
+        """
+        for table in self.schemas:
+            self.flush_table(table)
+        for table, writer in self.writers.items():
+            writer.close()
+            path = self.get_path(table, self.part)
+            os.replace(f'{path}.tmp', path)
+        if self.writers:
+            self.part += 1
+        self.writers = {}
+        return self.part
+
+    def close(self):
+        self.checkpoint()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parse_date(date):
+    return datetime.fromisoformat(date) if date else None
+
+
+def read_jsonl(path):
+    """
+    Reads the records of a .jsonl dump, optionally compressed with gzip (.gz) or zstd (.zst).
+    """
+    if path.endswith('.gz'):
+        file = gzip.open(path, 'rt', encoding='utf-8')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Reading .zst files requires the `zstandard` package')
+        # outputs checkpointed by the generator are made of several frames
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        file = io.TextIOWrapper(reader, encoding='utf-8')
+    else:
+        file = open(path, 'r', encoding='utf-8')
+    with file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_repository_name(path):
+    name = os.path.basename(path)
+    for extension in ('.gz', '.zst', '.jsonl'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
+
+def convert_jsonl(path, output_dir, compression=None):
+    with ParquetTablesWriter(output_dir, get_repository_name(path), compression) as writer:
+        for record in read_jsonl(path):
+            writer.write(record)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts .jsonl dumps of the generator to Parquet tables.')
+    parser.add_argument('--input', type=str, required=True,
+                        help='A .jsonl(.gz/.zst) file or a directory of such files.')
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'zstd'])
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        paths = sorted(path for pattern in ('*.jsonl', '*.jsonl.gz', '*.jsonl.zst')
+                       for path in glob.glob(os.path.join(args.input, pattern)))
+    else:
+        paths = [args.input]
+    for path in paths:
+        print(f'Converting {path}')
+        convert_jsonl(path, args.output_dir, args.compression)
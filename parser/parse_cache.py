@@ -0,0 +1,83 @@
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+# sqlite connections cannot be shared across processes, they are opened once per (process, cache file), and shared
+# by the threads of the process (e.g., the threads prefetching the releases) with a lock.
+_connections = {}
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed Python files keyed by a hash of the file content.
+    Entries are evicted least recently used first once the cache grows larger than `max_size` bytes.
+    """
+    # bump when the content of the parse records changes
+    VERSION = 2
+    # avoid a write on every cache hit, the last access time is only refreshed after this delay (seconds)
+    ACCESS_TIME_RESOLUTION = 3600
+
+    def __init__(self, path, max_size=10 * 1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+        # records are serialized with marshal, whose format is specific to the Python version
+        self.key_prefix = f'{self.VERSION}-py{sys.version_info[0]}{sys.version_info[1]}'
+
+    def connect(self):
+        """
+        Returns the connection of the process to the cache and the lock guarding it.
+        """
+        key = (os.getpid(), self.path)
+        if key not in _connections:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_access REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+            _connections[key] = connection, threading.Lock()
+        return _connections[key]
+
+    def get_key(self, content_hash):
+        return f'{self.key_prefix}-{content_hash}'
+
+    def get(self, content_hash):
+        key = self.get_key(content_hash)
+        connection, lock = self.connect()
+        with lock:
+            row = connection.execute('SELECT data, last_access FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            data, last_access = row
+            now = time.time()
+            if now - last_access > self.ACCESS_TIME_RESOLUTION:
+                connection.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+        return marshal.loads(zlib.decompress(data))
+
+    def put(self, content_hash, record):
+        data = zlib.compress(marshal.dumps(record))
+        connection, lock = self.connect()
+        with lock:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                               (self.get_key(content_hash), data, len(data), time.time()))
+
+    def evict(self):
+        connection, lock = self.connect()
+        with lock:
+            total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total_size <= self.max_size:
+                return
+
+            evicted_keys = []
+            for key, size in connection.execute('SELECT key, size FROM entries ORDER BY last_access'):
+                if total_size <= self.max_size:
+                    break
+                evicted_keys.append((key,))
+                total_size -= size
+            connection.executemany('DELETE FROM entries WHERE key = ?', evicted_keys)
@@ -1,13 +1,29 @@
 import ast
+import bisect
 import glob
+import hashlib
+import io
+import json
 import multiprocessing
 import os
+import posixpath
 import sys
+import tarfile
+import tokenize
+from array import array
+from functools import partial
 from pathlib import Path
 
 from pkg_resources import Requirement
 from tqdm import tqdm
 
+# archives are read with the member paths of their extraction
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'miner'))
+from extract_data import get_member_path
+
+# ids of the files, methods and function calls of the records, see `get_stable_id`
+ID_SCHEME = 'blake2b-128'
+
 tqdm_kwargs = {
     'bar_format': '{l_bar}{bar:100}{r_bar}{bar:-10b}',
     'file': sys.stdout
@@ -15,37 +31,147 @@ tqdm_kwargs = {
 
 
 class Repository:
-    def __init__(self, path, base_path='data', num_workers=16):
+    # archives downloaded for each release, see `miner/swh_miner.py`
+    ARCHIVE_NAMES = ('data.tar.gz', 'data.tar')
+
+    def __init__(self, path, base_path='data', num_workers=os.cpu_count(), cache=None, unparse=True, pool=None,
+                 show_progress=True, archive=None):
         self.path = path
+        # files are read from the archive of the release when it was not extracted
+        self.archive = archive if archive is not None else self.find_archive(path)
         self.relative_path = os.path.relpath(self.path, base_path)
         self.num_workers = num_workers
+        # long-lived pool shared across releases, a temporary pool of `num_workers` processes is used otherwise
+        self.pool = pool
+        self.show_progress = show_progress
+        self.cache = cache
+        # without unparsing, methods only hold metadata (no content and function calls)
+        self.unparse = unparse
         self.files = []
         self.requirements = None
         self.init_python_files()
         self.init_requirements()
 
+    @classmethod
+    def find_archive(cls, path):
+        """
+        Returns the archive of a release whose directory only holds the archive (i.e., it was not extracted).
+        """
+        if not os.path.isdir(path):
+            return None
+        entries = os.listdir(path)
+        for archive_name in cls.ARCHIVE_NAMES:
+            if archive_name in entries and all(entry in cls.ARCHIVE_NAMES for entry in entries):
+                return os.path.join(path, archive_name)
+        return None
+
     def init_python_files(self):
-        python_files = [Path(file) for file in glob.iglob(os.path.join(self.path, '**/*.py'), recursive=True)]
-
-        if self.num_workers > 0:
-            with multiprocessing.Pool(16) as pool:
-                self.files = list(tqdm(pool.imap(self.parse_python_file, python_files),
-                                       total=len(python_files),
-                                       desc='Parsing .py files',
-                                       **tqdm_kwargs))
+        if self.archive is not None:
+            # files are in the same order as an extracted release, the files mapping depends on it
+            members = dict(sorted(self.read_archive().items()))
+            python_files = [Path(os.path.join(self.path, relative_path)) for relative_path in members]
+            # workers receive the content of the files read from the archive
+            parse = partial(parse_python_data, cache=self.cache, unparse=self.unparse)
+            items = list(members.items())
+            sizes = [len(data) for data in members.values()]
+        else:
+            python_files = [Path(file) for file in sorted(glob.iglob(os.path.join(self.path, '**/*.py'),
+                                                                    recursive=True))]
+            # workers only receive a path and send back a flat record of the parsed file
+            parse = partial(parse_python_file, repository_path=self.path, cache=self.cache, unparse=self.unparse)
+            items = python_files
+            sizes = None
+
+        if self.pool is not None:
+            records = self.parse_in_pool(self.pool, parse, items, sizes)
+        elif self.num_workers > 0:
+            with multiprocessing.Pool(self.num_workers) as pool:
+                records = self.parse_in_pool(pool, parse, items, sizes)
         else:
-            self.files = [self.parse_python_file(file)
-                          for file in tqdm(python_files, desc='Parsing .py files', **tqdm_kwargs)]
+            records = [parse(item) for item in tqdm(items, desc='Parsing .py files',
+                                                    disable=not self.show_progress, **tqdm_kwargs)]
+        self.files = [PythonFile(file, self, record) for file, record in zip(python_files, records)]
 
-    def parse_python_file(self, file):
-        return PythonFile(file, self)
+        if self.cache is not None:
+            self.cache.evict()
+
+    def read_archive(self):
+        """
+        Reads the .py files and the requirements of the release in a single pass over its archive, with the same
+        relative paths as `miner/extract_data.py` (first path component stripped, hidden files skipped like `glob`).
+        Linked .py files are read from their target, as `glob` follows the links of an extracted release.
+        Returns the content of the .py files by relative path.
+        """
+        python_files = {}
+        # relative path of the .py links -> relative path of their target (None outside of the release)
+        links = {}
+        self.requirements_content = None
+        with tarfile.open(self.archive, mode='r|*') as archive:
+            for member in archive:
+                if not (member.isfile() or member.issym() or member.islnk()):
+                    continue
+                relative_path = get_member_path(member.name)
+                if relative_path is None or any(component.startswith('.')
+                                                for component in relative_path.split(os.sep)):
+                    continue
+                if member.issym() or member.islnk():
+                    if relative_path.endswith('.py'):
+                        # hard links name a member of the archive, symbolic links a path relative to the link
+                        target = member.linkname if member.islnk() else posixpath.normpath(
+                            posixpath.join(posixpath.dirname(member.name), member.linkname))
+                        links[relative_path] = get_member_path(target) if not target.startswith('/') else None
+                elif relative_path.endswith('.py'):
+                    python_files[relative_path] = archive.extractfile(member).read()
+                elif relative_path == 'requirements.txt':
+                    self.requirements_content = archive.extractfile(member).read()
+
+        for relative_path, target in links.items():
+            # chains of links, broken links are kept without content
+            for _ in range(len(links)):
+                if target not in links:
+                    break
+                target = links[target]
+            python_files[relative_path] = python_files.get(target, b'')
+        return python_files
+
+    def parse_in_pool(self, pool, parse, items, sizes=None):
+        # largest files first so that a single large file does not leave the pool waiting on it at the end,
+        # small chunks keep the largest files spread across the workers
+        if sizes is None:
+            sizes = [self.get_file_size(item) for item in items]
+        order = sorted(range(len(items)), key=lambda i: sizes[i], reverse=True)
+        chunksize = max(1, min(16, len(items) // (max(self.num_workers, 1) * 16)))
+
+        records = [None] * len(items)
+        tasks = pool.imap_unordered(partial(parse_indexed, parse=parse), [(i, items[i]) for i in order],
+                                    chunksize=chunksize)
+        for i, record in tqdm(tasks, total=len(items), desc='Parsing .py files',
+                              disable=not self.show_progress, **tqdm_kwargs):
+            records[i] = record
+        return records
+
+    @staticmethod
+    def get_file_size(path):
+        # broken links and unreadable entries are still parsed (without methods), as in the serial path
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
 
     def init_requirements(self):
         requirements_file_path = os.path.join(self.path, 'requirements.txt')
 
-        if os.path.exists(requirements_file_path):
+        if self.archive is not None:
+            if self.requirements_content is not None:
+                self.requirements = RequirementsFile(requirements_file_path, self.requirements_content)
+        elif os.path.exists(requirements_file_path):
             self.requirements = RequirementsFile(requirements_file_path)
 
+    def restore_function_calls_order(self):
+        for file in self.files:
+            for method in file.methods:
+                method.restore_fc_calls_order()
+
     def get_all_files_paths(self):
         return [str(file) for file in self.files]
 
@@ -53,76 +179,135 @@ class Repository:
         return str(self.relative_path)
 
 
+def get_stable_id(*values):
+    # same values as the hashes of the entities, but ids are identical across processes and runs, unlike hash()
+    # (randomised for str, address-based for None), so that a resumed output can map to the records written before
+    return hashlib.blake2b(json.dumps(values).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_python_file(path, repository_path, cache=None, unparse=True):
+    """
+    Parses a .py file, in a worker process. Returns a flat record (relative_path, content_hash, methods, imports)
+    of tuples, see `PythonFile.parse_content`.
+    """
+    relative_path = os.path.relpath(path, repository_path)
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except:
+        return relative_path, None, [], []
+    return parse_python_data((relative_path, data), cache, unparse)
+
+
+def parse_python_data(item, cache=None, unparse=True):
+    """
+    Parses the content of a .py file given as (relative_path, bytes), see `parse_python_file`.
+    """
+    relative_path, data = item
+    try:
+        # same newline translation as reading the file in text mode
+        content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    except:
+        return relative_path, None, [], []
+    content_hash = hashlib.blake2b(data, digest_size=20).hexdigest()
+    if not content:
+        return relative_path, content_hash, [], []
+
+    cache_key = content_hash if unparse else f'{content_hash}-metadata'
+    parsed_content = cache.get(cache_key) if cache is not None else None
+    if parsed_content is None:
+        try:
+            parsed_content = PythonFile.parse_content(content, unparse)
+        except SyntaxError:
+            # files with an invalid syntax are kept, without methods and imports
+            parsed_content = [], []
+        if cache is not None:
+            cache.put(cache_key, parsed_content)
+
+    methods, imports = parsed_content
+    return relative_path, content_hash, methods, imports
+
+
+def parse_indexed(item, parse):
+    index, file = item
+    return index, parse(file)
+
+
 class PythonFile:
-    def __init__(self, path, repository):
+    def __init__(self, path, repository, record=None):
         self.path = path
         self.relative_path = os.path.relpath(self.path, repository.path)
         self.repository = repository
-        self.methods = []
-        self.imports = []
-        self.content = self.read_content()
-        if self.content:
-            try:
-                self.parse_content()
-            except SyntaxError:
-                del self
-
-    def read_content(self):
-        try:
-            with open(self.path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except:
-            del self
-
-    def parse_content(self):
+        if record is None:
+            record = parse_python_file(path, repository.path, repository.cache, repository.unparse)
+        _, self.content_hash, methods, imports = record
+        self.methods = [Method(self, *method) for method in methods]
+        self.imports = [Import(*i) for i in imports]
+
+    @classmethod
+    def parse_content(cls, content, unparse=True):
+        """
+        Extracts the methods (class_name, name, params, content, content_hash, function_calls) and the
+        imports (name, alias, content) of a file. A function call is (name, context, expression, start_offset,
+        end_offset, line_number).
+        """
+        methods = []
+        imports = []
         try:
-            tree = ast.parse(self.content)
+            tree = ast.parse(content)
 
             # retrieve standalone functions
             standalone_functions = [n for n in tree.body if isinstance(n, ast.FunctionDef)]
             for f in standalone_functions:
-                name, content, params = self.get_function_node_info(f)
-                function = Method(file=self, class_name=None, name=name, params=params, content=content)
-                self.methods.append(function)
+                methods.append((None, *cls.get_function_node_info(f, unparse)))
 
             # retrieve class methods
             classes = [n for n in tree.body if isinstance(n, ast.ClassDef)]
-            for cls in classes:
-                methods = [n for n in cls.body if isinstance(n, ast.FunctionDef)]
-                for m in methods:
-                    name, content, params = self.get_function_node_info(m)
-                    function = Method(file=self, class_name=cls.name, name=name, params=params, content=content)
-                    self.methods.append(function)
+            for class_node in classes:
+                class_methods = [n for n in class_node.body if isinstance(n, ast.FunctionDef)]
+                for m in class_methods:
+                    methods.append((class_node.name, *cls.get_function_node_info(m, unparse)))
 
             # retrieve imports
-            imports = [n for n in tree.body if isinstance(n, ast.Import)]
-            for i in imports:
+            import_nodes = [n for n in tree.body if isinstance(n, ast.Import)]
+            for i in import_nodes:
                 for alias in i.names:
-                    import_name, import_alias, full_import_name = self.get_import_alias_info(alias)
-                    import_obj = Import(import_name, import_alias, full_import_name)
-                    self.imports.append(import_obj)
+                    imports.append(cls.get_import_alias_info(alias))
 
             # retrieve imports from
             imports_from = [n for n in tree.body if isinstance(n, ast.ImportFrom)]
             for i in imports_from:
                 module = i.module
                 for alias in i.names:
-                    import_name, import_alias, full_import_name = self.get_import_alias_info(alias, module, True)
-                    import_obj = Import(import_name, import_alias, full_import_name)
-                    self.imports.append(import_obj)
+                    imports.append(cls.get_import_alias_info(alias, module, True))
         except SyntaxError:
             raise SyntaxError('Invalid Python syntax')
+        return methods, imports
 
-    def get_function_node_info(self, node):
+    @staticmethod
+    def get_function_node_info(node, unparse=True):
         name = node.name
-        content = ast.unparse(node)
         params = []
         for param in node.args.args:
             param_name = param.arg
             params.append(param_name)
-        return name, content, params
 
-    def get_import_alias_info(self, alias, module=None, import_from=False):
+        if not unparse:
+            return name, params, None, None, []
+
+        # function calls are located in the unparsed content while unparsing, the content is not parsed again
+        unparser = CallPositionUnparser()
+        content = unparser.visit(node)
+        content_hash = hashlib.blake2b(content.encode('utf-8'), digest_size=20).hexdigest()
+        function_calls = Method.extract_function_calls(node, content, unparser.call_positions)
+        if function_calls is None:
+            method = Method(None, None, name, params, content, content_hash)
+            function_calls = [(fc.name, fc.context, fc.expression, fc.start_offset, fc.end_offset,
+                               fc.line.line_number) for fc in method.function_calls]
+        return name, params, content, content_hash, function_calls
+
+    @staticmethod
+    def get_import_alias_info(alias, module=None, import_from=False):
         import_name = alias.name
         import_alias = alias.asname
         if import_alias is not None:
@@ -139,7 +324,7 @@ class PythonFile:
 
     def to_dict(self):
         return {
-            'id': str(self.__hash__()),
+            'id': get_stable_id(self.relative_path),
             'path': self.relative_path
         }
 
@@ -154,13 +339,18 @@ class PythonFile:
 
 
 class RequirementsFile:
-    def __init__(self, path):
+    def __init__(self, path, content=None):
         self.path = path
+        # content read from the archive of the release, the file is read from disk otherwise
+        self.content = content
         self.requirements = {}
 
     def parse(self):
-        with open(self.path, "r") as file:
-            requirements = file.readlines()
+        if self.content is not None:
+            requirements = self.content.decode('utf-8', errors='replace').splitlines()
+        else:
+            with open(self.path, "r") as file:
+                requirements = file.readlines()
 
         for req_line in requirements:
             req_line = req_line.strip()
@@ -183,69 +373,208 @@ class RequirementsFile:
 
 
 class Method:
-    def __init__(self, file, class_name, name, params, content=None):
+    # a release holds millions of methods, lines and function calls
+    __slots__ = ('file', 'class_name', 'name', 'params', 'content', 'content_hash', 'line_offsets', '_locs',
+                 '_locs_no_comments', '_content_no_comments', 'fc_names', 'fc_contexts', 'fc_expressions',
+                 'fc_offsets', 'fc_order')
+
+    def __init__(self, file, class_name, name, params, content=None, content_hash=None, function_calls=None):
         self.file = file
         self.class_name = class_name
         self.name = name
         self.params = params
         self.content = content
-        self.locs = []
-        self.locs_no_comments = []
-        self.retrieve_lines()
-        self.content_no_comments = '\n'.join([loc.get_line_content() for loc in self.locs_no_comments])
-        self.function_calls = []
-        self.retrieve_function_calls()
+        # fingerprint of the content, identical methods are not compared
+        self.content_hash = content_hash
+        if content is not None and content_hash is None:
+            self.content_hash = hashlib.blake2b(content.encode('utf-8'), digest_size=20).hexdigest()
+        # lines are offsets into `content`
+        self.line_offsets = array('q', self.get_line_offsets(content) if content is not None else [])
+        # lines are not part of the generated data, they are only retrieved when accessed (see `retrieve_lines`)
+        self._locs = None
+        self._locs_no_comments = None
+        self._content_no_comments = None
+        if function_calls is None:
+            self.retrieve_function_calls()
+        else:
+            self.set_function_calls(function_calls)
+
+    @property
+    def locs(self):
+        if self._locs is None:
+            self.retrieve_lines()
+        return self._locs
+
+    @property
+    def locs_no_comments(self):
+        if self._locs_no_comments is None:
+            self.retrieve_lines()
+        return self._locs_no_comments
+
+    @property
+    def content_no_comments(self):
+        if self._content_no_comments is None:
+            self._content_no_comments = '\n'.join([loc.get_line_content() for loc in self.locs_no_comments])
+        return self._content_no_comments
 
     def retrieve_lines(self):
+        """
+        Retrieves the lines of the method, and the lines of code, i.e., the lines that are neither empty, comments,
+        nor part of a docstring.
+        """
+        self._locs = []
+        self._locs_no_comments = []
         if self.content is not None:
-            lines = self.content.split('\n')
-            inside_multi_line_comment = False
-
-            current_line_number = 0
-            for i, line in enumerate(lines):
-                current_line_number += 1
-                # ignore comments, but still take them into account in the line counter.
-                if not inside_multi_line_comment:
-                    # check for the start of a multi-line comment
-                    if "'''" in line or '"""' in line:
-                        inside_multi_line_comment = True
-
-                    # exclude single-line comments and empty lines
-                    elif line.strip() and not line.strip().startswith('#'):
-                        loc = LOC(i, line)
-                        self.locs_no_comments.append(loc)
-                else:
-                    # check for the end of a multi-line comment
-                    if "'''" in line or '"""' in line:
-                        inside_multi_line_comment = False
-                loc = LOC(i, line)
-                self.locs.append(loc)
+            self._locs = [self.get_loc(i) for i in range(len(self.line_offsets) - 1)]
+            try:
+                code_lines = self.get_code_lines(self.content)
+            except (tokenize.TokenError, SyntaxError):
+                code_lines = self.get_code_lines_from_text(self.content)
+            self._locs_no_comments = [self._locs[i] for i in sorted(code_lines)]
+
+    @staticmethod
+    def get_code_lines(code):
+        """
+        Indexes of the lines of code, from the tokens of `code`. Statements made of strings only (docstrings) are
+        not code, and a line with code and a comment is a line of code.
+        """
+        code_lines = set()
+        statement = []
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type in (tokenize.COMMENT, tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+                continue
+            if token.type != tokenize.NEWLINE:
+                statement.append(token)
+                continue
+            if any(statement_token.type != tokenize.STRING for statement_token in statement):
+                for statement_token in statement:
+                    code_lines.update(range(statement_token.start[0] - 1, statement_token.end[0]))
+            statement = []
+        return code_lines
+
+    @staticmethod
+    def get_code_lines_from_text(code):
+        # fallback for code that cannot be tokenized: lines between triple quotes are considered as docstrings
+        code_lines = set()
+        inside_multi_line_comment = False
+        for i, line in enumerate(code.split('\n')):
+            if not inside_multi_line_comment:
+                # check for the start of a multi-line comment
+                if "'''" in line or '"""' in line:
+                    inside_multi_line_comment = True
+                # exclude single-line comments and empty lines
+                elif line.strip() and not line.strip().startswith('#'):
+                    code_lines.add(i)
+            elif "'''" in line or '"""' in line:
+                # end of a multi-line comment
+                inside_multi_line_comment = False
+        return code_lines
+
+    def get_loc(self, line_number):
+        return LOC(line_number, self.content, self.line_offsets[line_number], self.line_offsets[line_number + 1] - 1)
+
+    def set_function_calls(self, function_calls):
+        """
+        Stores function calls (name, context, expression, start_offset, end_offset, line_number) in parallel
+        arrays, `FunctionCall` objects are only created when the function calls are accessed.
+        """
+        self.fc_names = tuple(fc[0] for fc in function_calls)
+        self.fc_contexts = tuple(fc[1] for fc in function_calls)
+        self.fc_expressions = tuple(fc[2] for fc in function_calls)
+        # start offset, end offset and line number of each function call
+        self.fc_offsets = array('q', [value for fc in function_calls for value in fc[3:6]])
+        # order of the function calls when sorted, extraction order otherwise
+        self.fc_order = None
+
+    @property
+    def function_calls(self):
+        order = self.fc_order if self.fc_order is not None else range(len(self.fc_names))
+        return [self.get_function_call(i) for i in order]
+
+    def get_function_call(self, index):
+        start_offset, end_offset, line_number = self.fc_offsets[3 * index:3 * index + 3]
+        return FunctionCall(self.fc_names[index], self.fc_contexts[index], self.fc_expressions[index],
+                            start_offset, end_offset, self.get_loc(line_number))
 
     def retrieve_function_calls(self):
         tree = ast.parse(self.content)
-        for node in ast.walk(tree):
-            self.process_call_node(node)
-
-    def process_call_node(self, node):
-        if isinstance(node, ast.Call):
-            context = self.get_call_context(node)
-            function_name = self.get_call_name(node)
-
-            fc_name = function_name
-            if context is not None:
-                fc_name = context
-                context = function_name
-
-            if fc_name:
-                function_call_expr = ast.unparse(node)
-                start_line = node.lineno - 1
-                start_offset = self.get_start_char_index(self.content, start_line, node)
-                end_offset = start_offset + len(function_call_expr)
-                fc = FunctionCall(fc_name, context, function_call_expr, start_offset, end_offset, self.locs[start_line])
-                if fc not in self.function_calls:
-                    self.function_calls.append(fc)
-        for child_node in ast.iter_child_nodes(node):
-            self.process_call_node(child_node)
+        line_offsets = self.get_line_offsets(self.content)
+        extracted = set()
+        function_calls = []
+
+        # single pre-order traversal of the tree, calls are extracted in the order they are visited
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, ast.Call):
+                fc = self.process_call_node(node, line_offsets)
+                if fc is not None:
+                    # (expression, start_offset, end_offset)
+                    key = fc[2:5]
+                    if key not in extracted:
+                        extracted.add(key)
+                        function_calls.append(fc)
+            children = list(ast.iter_child_nodes(node))
+            children.reverse()
+            nodes.extend(children)
+        self.set_function_calls(function_calls)
+
+    def process_call_node(self, node, line_offsets):
+        fc_name, context = self.get_call_name_and_context(node)
+        if fc_name:
+            function_call_expr = ast.unparse(node)
+            start_line = node.lineno - 1
+            start_offset = line_offsets[start_line] + node.col_offset
+            end_offset = start_offset + len(function_call_expr)
+            return fc_name, context, function_call_expr, start_offset, end_offset, start_line
+        return None
+
+    @classmethod
+    def extract_function_calls(cls, node, content, call_positions):
+        """
+        Extracts the function calls of a function node of the file AST, using the positions of the calls in
+        the unparsed `content`. Offsets are identical to the ones obtained by parsing `content` again.
+        Returns None if a call could not be located in the unparsed content (e.g., calls in f-strings).
+        """
+        line_offsets = cls.get_line_offsets(content)
+        extracted = set()
+        function_calls = []
+
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, ast.Call):
+                fc_name, context = cls.get_call_name_and_context(node)
+                if fc_name:
+                    if node not in call_positions:
+                        return None
+                    start_char, end_char = call_positions[node]
+                    function_call_expr = content[start_char:end_char]
+                    start_line = bisect.bisect_right(line_offsets, start_char) - 1
+                    # column offsets of the AST are in bytes
+                    col_offset = len(content[line_offsets[start_line]:start_char].encode('utf-8'))
+                    start_offset = line_offsets[start_line] + col_offset
+                    end_offset = start_offset + len(function_call_expr)
+                    key = (function_call_expr, start_offset, end_offset)
+                    if key not in extracted:
+                        extracted.add(key)
+                        function_calls.append((fc_name, context, function_call_expr, start_offset, end_offset,
+                                               start_line))
+            children = list(ast.iter_child_nodes(node))
+            children.reverse()
+            nodes.extend(children)
+        return function_calls
+
+    @classmethod
+    def get_call_name_and_context(cls, call_node):
+        context = cls.get_call_context(call_node)
+        function_name = cls.get_call_name(call_node)
+
+        fc_name = function_name
+        if context is not None:
+            fc_name = context
+            context = function_name
+        return fc_name, context
 
     @staticmethod
     def get_call_name(call_node):
@@ -266,18 +595,27 @@ class Method:
             return None
 
     @staticmethod
-    def get_start_char_index(code, start_line, node):
-        lines = code.split('\n')
-        # + 1 accounts for the \n tokens that is removed when splitting the code
-        start_char = sum(len(line) + 1 for line in lines[:start_line]) + node.col_offset
-        return start_char
+    def get_line_offsets(code):
+        # start offset of each line, + 1 accounts for the \n tokens that is removed when splitting the code
+        line_offsets = [0]
+        for line in code.split('\n'):
+            line_offsets.append(line_offsets[-1] + len(line) + 1)
+        return line_offsets
 
     def sort_fc_calls_by_start_offset(self):
-        self.function_calls.sort(key=lambda fc: fc.start_offset)
+        order = self.fc_order if self.fc_order is not None else range(len(self.fc_names))
+        self.fc_order = sorted(order, key=lambda i: self.fc_offsets[3 * i])
+
+    def restore_fc_calls_order(self):
+        # restore the order in which the function calls have been extracted
+        self.fc_order = None
+
+    def get_signature(self):
+        return self.class_name, self.name, tuple(self.params)
 
     def to_dict(self):
         return {
-            'id': str(self.__hash__()),
+            'id': get_stable_id(self.class_name, self.name, ' '.join(self.params)),
             'class': self.class_name,
             'name': self.name,
             'params': self.params,
@@ -291,7 +629,7 @@ class Method:
         return hash((self.class_name, self.name, ' '.join(self.params)))
 
     def __len__(self):
-        return len(self.all_locs)
+        return len(self.locs)
 
     def __eq__(self, other):
         return self.class_name == other.class_name and self.name == other.name and self.params == other.params
@@ -300,14 +638,52 @@ class Method:
         return self.class_name == other.class_name and self.name == other.name
 
 
+class CallPositionUnparser(ast._Unparser):
+    """
+    Unparser recording the start and end character offsets of the call nodes in the unparsed code.
+    Calls unparsed into a separate buffer (f-strings, lambda arguments) are not recorded.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.call_positions = {}
+        self.root_source = None
+        self.length = 0
+
+    def visit(self, node):
+        self._source = []
+        self.root_source = self._source
+        self.length = 0
+        self.traverse(node)
+        return "".join(self._source)
+
+    def write(self, *text):
+        if self._source is self.root_source:
+            for t in text:
+                self.length += len(t)
+        super().write(*text)
+
+    def visit_Call(self, node):
+        recorded = self._source is self.root_source
+        start = self.length
+        super().visit_Call(node)
+        if recorded:
+            self.call_positions[node] = (start, self.length)
+
+
 class Import:
+    __slots__ = ('name', 'alias', 'content')
+
     def __init__(self, name, alias=None, content=None):
         self.name = name
         self.alias = alias
         self.content = content
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'name': self.name,
+            'alias': self.alias,
+            'content': self.content
+        }
 
     def __eq__(self, other):
         return (self.name == other.name and self.alias == other.alias) or self.content == other.content
@@ -320,9 +696,18 @@ class Import:
 
 
 class LOC:
-    def __init__(self, line_number, content):
+    __slots__ = ('line_number', 'source', 'start', 'end')
+
+    def __init__(self, line_number, source, start=0, end=None):
+        # the line is source[start:end], e.g., a line of the content of a method, it is not copied
         self.line_number = line_number
-        self.content = content.strip()
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def content(self):
+        return self.source[self.start:self.end].strip()
 
     def get_line_content(self):
         return self.content
@@ -335,6 +720,8 @@ class LOC:
 
 
 class FunctionCall:
+    __slots__ = ('name', 'context', 'expression', 'start_offset', 'end_offset', 'line')
+
     def __init__(self, fc_name, context, fc_expression, start_offset, end_offset, line):
         self.name = fc_name
         self.context = context
@@ -345,7 +732,7 @@ class FunctionCall:
 
     def to_dict(self):
         return {
-            'id': str(self.__hash__()),
+            'id': get_stable_id(self.expression, self.start_offset, self.end_offset),
             'name': self.name,
             'context': self.context,
             'expression': self.expression,
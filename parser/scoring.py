@@ -0,0 +1,122 @@
+import Levenshtein
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from rapidfuzz import process
+except ImportError:
+    process = None
+
+# statistics of the pairs excluded by the cutoffs of a scorer
+UNSCORED = (None, None)
+
+
+class Scorer:
+    """
+    Computes the statistics of pairs of strings: their ratio (`Levenshtein.ratio`) and distance
+    (`Levenshtein.distance`). Without cutoffs, the statistics are identical to calling both functions.
+    - `min_length_ratio`: pairs whose shortest string is shorter than `min_length_ratio` times the longest string
+      are not scored.
+    - `ratio_cutoff`: pairs with a lower ratio are not scored, the ratio is computed first and stops early.
+    - `max_distance`: pairs with a higher distance are not scored, the distance only explores the edits up to
+      `max_distance`.
+    Pairs that are not scored have `None` statistics. Batches of at least `min_batch_size` pairs are scored with
+    `rapidfuzz` (and `numpy`) by `num_workers` threads, -1 for all the CPUs.
+    """
+    def __init__(self, min_length_ratio=None, ratio_cutoff=None, max_distance=None, num_workers=1,
+                 min_batch_size=64):
+        if num_workers != 1:
+            self.check_batch_scoring()
+        self.min_length_ratio = min_length_ratio
+        self.ratio_cutoff = ratio_cutoff
+        self.max_distance = max_distance
+        self.num_workers = num_workers
+        self.min_batch_size = min_batch_size
+
+    @staticmethod
+    def check_batch_scoring():
+        # raised before any pair is scored, rather than in the workers processing the repositories
+        missing = [name for name, module in (('numpy', np), ('rapidfuzz', process)) if module is None]
+        if missing:
+            raise ImportError('Scoring with several workers requires the `numpy` and `rapidfuzz` packages, '
+                              f'missing: {", ".join(missing)}')
+        if not hasattr(process, 'cpdist'):
+            raise ImportError('Scoring with several workers requires `rapidfuzz>=3.6` (`process.cpdist`)')
+
+    @property
+    def cutoffs(self):
+        # the cutoffs change the statistics
+        return {
+            'min_length_ratio': self.min_length_ratio,
+            'ratio_cutoff': self.ratio_cutoff,
+            'max_distance': self.max_distance
+        }
+
+    def has_cutoffs(self):
+        return any(cutoff is not None for cutoff in self.cutoffs.values())
+
+    @staticmethod
+    def ratio(str1, str2, score_cutoff=None):
+        # ratios lower than `score_cutoff` are 0
+        return Levenshtein.ratio(str1, str2, score_cutoff=score_cutoff)
+
+    def score(self, str1, str2):
+        return self.score_pairs([(str1, str2)])[0]
+
+    def score_pairs(self, pairs):
+        """
+        Returns the (ratio, distance) of each pair of strings of `pairs`.
+        """
+        scores = [self.prefilter(str1, str2) for str1, str2 in pairs]
+        indexes = [i for i, score in enumerate(scores) if score is None]
+
+        ratios = {}
+        if self.ratio_cutoff is not None:
+            # ratios equal to the cutoff can be rounded below it by `score_cutoff`
+            for i, ratio in zip(indexes, self.compute(Levenshtein.ratio, pairs, indexes, self.ratio_cutoff - 1e-6)):
+                if ratio < self.ratio_cutoff:
+                    scores[i] = UNSCORED
+                else:
+                    ratios[i] = ratio
+            indexes = [i for i in indexes if scores[i] is None]
+
+        distances = self.compute(Levenshtein.distance, pairs, indexes, self.max_distance)
+        # distances of the pairs whose ratio is computed next
+        remaining = {}
+        for i, distance in zip(indexes, distances):
+            len1, len2 = len(pairs[i][0]), len(pairs[i][1])
+            if self.max_distance is not None and distance > self.max_distance:
+                scores[i] = UNSCORED
+            elif i in ratios:
+                scores[i] = ratios[i], distance
+            elif distance == abs(len1 - len2):
+                # only insertions and deletions: the distance is also the indel distance the ratio is computed from
+                scores[i] = 1 - distance / (len1 + len2), distance
+            else:
+                remaining[i] = distance
+        for (i, distance), ratio in zip(remaining.items(), self.compute(Levenshtein.ratio, pairs, list(remaining))):
+            scores[i] = ratio, distance
+        return scores
+
+    def prefilter(self, str1, str2):
+        # statistics known without scoring the pair, None otherwise
+        if str1 == str2:
+            return 1.0, 0
+        len1, len2 = len(str1), len(str2)
+        if self.min_length_ratio is not None and min(len1, len2) < self.min_length_ratio * max(len1, len2):
+            return UNSCORED
+        # the ratio is at most 2 * min(len1, len2) / (len1 + len2)
+        if self.ratio_cutoff is not None and 2 * min(len1, len2) / (len1 + len2) < self.ratio_cutoff - 1e-9:
+            return UNSCORED
+        return None
+
+    def compute(self, scorer, pairs, indexes, score_cutoff=None):
+        # large batches are scored at once, outside of the GIL
+        if self.num_workers != 1 and len(indexes) >= self.min_batch_size:
+            dtype = np.float64 if scorer is Levenshtein.ratio else np.int64
+            return process.cpdist([pairs[i][0] for i in indexes], [pairs[i][1] for i in indexes], scorer=scorer,
+                                  score_cutoff=score_cutoff, dtype=dtype, workers=self.num_workers).tolist()
+        return [scorer(pairs[i][0], pairs[i][1], score_cutoff=score_cutoff) for i in indexes]
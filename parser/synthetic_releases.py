@@ -0,0 +1,180 @@
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+# callees of the synthetic function calls, (context, name) as extracted by the parser
+CALLEES = (
+    ('np', 'mean'), ('np', 'zeros'), ('os', 'getenv'), ('json', 'dumps'), ('self', 'update'), ('self', 'reset'),
+    (None, 'len'), (None, 'sorted'), (None, 'isinstance'), ('logging', 'info'), ('torch', 'cat'), ('re', 'sub')
+)
+REQUIREMENTS = 'numpy>=1.20\ntorch==2.0.1\nrequests\n'
+
+
+class SyntheticRepository:
+    """
+    Deterministic release history of a synthetic Python repository, for benchmarks. Each file has a class and
+    top-level functions, made of `method_lines` lines where a line has a function call with probability
+    `call_density`. Between two releases, a fraction `mutation_rate` of the methods is modified (lines and
+    function calls changed, added or removed), and methods and files are added, removed or renamed at a lower rate.
+    The same `seed` always generates the same history.
+    """
+    def __init__(self, name='synthetic', n_files=100, n_methods=10, method_lines=20, call_density=.5,
+                 mutation_rate=.1, seed=0):
+        self.name = name
+        self.n_files = n_files
+        self.n_methods = n_methods
+        self.method_lines = method_lines
+        self.call_density = call_density
+        self.mutation_rate = mutation_rate
+        self.random = random.Random(f'{name}-{seed}')
+        self.n_created = 0
+        # relative path -> list of [class_name, name, params, lines]
+        self.files = {}
+        for _ in range(n_files):
+            self.add_file()
+
+    def get_identifier(self, prefix):
+        self.n_created += 1
+        return f'{prefix}_{self.n_created}'
+
+    def get_line(self):
+        variable = self.random.choice(('x', 'y', 'result', 'values', 'index'))
+        if self.random.random() >= self.call_density:
+            return f'{variable} = {variable} + {self.random.randint(0, 100)}'
+        context, name = self.random.choice(CALLEES)
+        call = f'{context}.{name}' if context is not None else name
+        arguments = self.random.sample(('x', 'y', 'values', 'index', '1', "'key'"), self.random.randint(0, 3))
+        arguments = ', '.join(arguments)
+        # some calls are nested
+        if self.random.random() < .2:
+            arguments = f'len({arguments or "values"})'
+        return f'{variable} = {call}({arguments})'
+
+    def get_method(self, class_name):
+        params = (['self'] if class_name is not None else []) + ['x', 'y'][:self.random.randint(0, 2)]
+        n_lines = max(1, int(self.random.gauss(self.method_lines, self.method_lines / 4)))
+        return [class_name, self.get_identifier('method'), params, [self.get_line() for _ in range(n_lines)]]
+
+    def add_file(self):
+        directory = self.random.choice(('core', 'models', 'utils', 'data'))
+        class_name = self.get_identifier('Component')
+        methods = [self.get_method(class_name if i % 2 == 0 else None) for i in range(self.n_methods)]
+        self.files[f'{self.name}/{directory}/{self.get_identifier("module")}.py'] = methods
+
+    def mutate_method(self, method):
+        lines = method[3]
+        for _ in range(self.random.randint(1, 3)):
+            position = self.random.randrange(len(lines) + 1)
+            mutation = self.random.random()
+            if mutation < .4 and position < len(lines):
+                lines[position] = self.get_line()
+            elif mutation < .7 or len(lines) < 2:
+                lines.insert(position, self.get_line())
+            elif position < len(lines):
+                del lines[position]
+        # parameters rarely change
+        if self.random.random() < .05:
+            method[2] = method[2] + [self.get_identifier('arg')]
+
+    def mutate(self):
+        """
+        Changes the repository to its next release.
+        """
+        for path in sorted(self.files):
+            methods = self.files[path]
+            for method in methods:
+                if self.random.random() < self.mutation_rate:
+                    self.mutate_method(method)
+            if self.random.random() < self.mutation_rate / 2 and len(methods) > 1:
+                del methods[self.random.randrange(len(methods))]
+            if self.random.random() < self.mutation_rate / 2:
+                methods.insert(self.random.randrange(len(methods) + 1), self.get_method(None))
+
+        for path in sorted(self.files):
+            mutation = self.random.random()
+            if mutation < self.mutation_rate / 10 and len(self.files) > 1:
+                del self.files[path]
+            elif mutation < self.mutation_rate / 5:
+                # renamed file (mapped on its methods by the comparator)
+                directory, file_name = os.path.split(path)
+                self.files[f'{directory}/{file_name[:-3]}_v2.py'] = self.files.pop(path)
+        if self.random.random() < self.mutation_rate:
+            self.add_file()
+
+    @staticmethod
+    def render_file(methods):
+        imports = ['import json', 'import logging', 'import os', 'import re', '', 'import numpy as np', 'import torch']
+        class_lines = []
+        function_lines = []
+        for class_name, name, params, lines in methods:
+            indent = '    ' if class_name is not None else ''
+            target = class_lines if class_name is not None else function_lines
+            target.append(f'{indent}def {name}({", ".join(params)}):')
+            target.extend(f'{indent}    {line}' for line in lines)
+            target.append(f'{indent}    return x')
+            target.append('')
+        class_names = [method[0] for method in methods if method[0] is not None]
+        if class_names:
+            class_lines = [f'class {class_names[0]}:'] + class_lines
+        return '\n'.join(imports + ['', ''] + class_lines + [''] + function_lines) + '\n'
+
+    def write_release(self, release_dir):
+        for path, methods in self.files.items():
+            file_path = os.path.join(release_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as file:
+                file.write(self.render_file(methods))
+        with open(os.path.join(release_dir, 'requirements.txt'), 'w') as file:
+            file.write(REQUIREMENTS)
+
+
+def generate_releases(output_dir, n_repositories=1, n_releases=5, **kwargs):
+    """
+    Writes the releases of `n_repositories` synthetic repositories in `output_dir` (one directory per repository
+    and release, as downloaded by the miner), and their `download_data.csv`. Returns the path of the .csv file.
+    """
+    rows = []
+    start_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_repositories):
+        repository = SyntheticRepository(name=f'synthetic{i}', **kwargs)
+        for release in range(n_releases):
+            if release > 0:
+                repository.mutate()
+            branch = f'v1.{release}.0'
+            repository.write_release(os.path.join(output_dir, repository.name, branch))
+            rows.append({
+                'repository': f'https://github.com/synthetic/{repository.name}',
+                'branch': branch,
+                'download_link': '',
+                'name': branch,
+                'date': (start_date + timedelta(days=30 * release)).isoformat()
+            })
+
+    download_data_fp = os.path.join(output_dir, 'download_data.csv')
+    with open(download_data_fp, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['repository', 'branch', 'download_link', 'name', 'date'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return download_data_fp
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--n_repositories', type=int, default=1)
+    parser.add_argument('--n_releases', type=int, default=5)
+    parser.add_argument('--n_files', type=int, default=100)
+    parser.add_argument('--n_methods', type=int, default=10, help='Number of methods per file.')
+    parser.add_argument('--method_lines', type=int, default=20, help='Average number of lines of a method.')
+    parser.add_argument('--call_density', type=float, default=.5,
+                        help='Probability that a line of a method has a function call.')
+    parser.add_argument('--mutation_rate', type=float, default=.1,
+                        help='Fraction of the methods modified between two releases.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate_releases(args.output_dir, args.n_repositories, args.n_releases, n_files=args.n_files,
+                            n_methods=args.n_methods, method_lines=args.method_lines,
+                            call_density=args.call_density, mutation_rate=args.mutation_rate, seed=args.seed))
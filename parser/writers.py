@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+JSON_ENCODERS = ('json', 'orjson')
+
+
+class JsonlWriter:
+    """
+    Writes records to a .jsonl file as they are produced, through a buffer of about `buffer_size` bytes.
+    The file is optionally compressed with gzip or zstd (`zstandard` package), and records can be encoded with
+    `orjson` instead of the standard `json` module (faster, but compact separators and non-ASCII characters kept).
+    With `position` (see `checkpoint`), the file is truncated to that position and records are appended.
+    """
+    def __init__(self, path, compression=None, json_encoder='json', buffer_size=1024 ** 2, compression_level=None,
+                 position=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression `{compression}`, expected one of {list(COMPRESSIONS)}')
+        if json_encoder not in JSON_ENCODERS:
+            raise ValueError(f'Unknown JSON encoder `{json_encoder}`, expected one of {list(JSON_ENCODERS)}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires the `zstandard` package')
+        if json_encoder == 'orjson' and orjson is None:
+            raise ImportError('The `orjson` encoder requires the `orjson` package')
+
+        self.path = path + COMPRESSIONS[compression]
+        self.compression = compression
+        self.json_encoder = json_encoder
+        self.buffer_size = buffer_size
+        self.compression_level = compression_level
+        self.position = position
+        self.buffer = []
+        self.buffered_size = 0
+        self.file = None
+        self.stream = None
+
+    def open(self):
+        if self.position is not None and os.path.exists(self.path):
+            self.file = open(self.path, 'r+b')
+            self.file.truncate(self.position)
+            self.file.seek(self.position)
+        else:
+            self.file = open(self.path, 'wb')
+        self.open_stream()
+        return self
+
+    def open_stream(self):
+        if self.compression == 'gzip':
+            level = self.compression_level if self.compression_level is not None else 6
+            # without a timestamp, the members of a resumed output are identical to the ones of a full run
+            self.stream = gzip.GzipFile(fileobj=self.file, mode='wb', compresslevel=level, mtime=0)
+        elif self.compression == 'zstd':
+            level = self.compression_level if self.compression_level is not None else 3
+            self.stream = zstandard.ZstdCompressor(level=level).stream_writer(self.file)
+        else:
+            self.stream = self.file
+
+    def encode(self, record):
+        if self.json_encoder == 'orjson':
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        return (json.dumps(record) + '\n').encode('utf-8')
+
+    def write(self, record):
+        data = self.encode(record)
+        self.buffer.append(data)
+        self.buffered_size += len(data)
+        if self.buffered_size >= self.buffer_size:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if self.buffer:
+            self.stream.write(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered_size = 0
+
+    def checkpoint(self):
+        """
+        Writes the buffered records and returns the position of the file to resume from after them. Compressed
+        files are made of one gzip member or zstd frame per checkpoint, so that they can be truncated there.
+        """
+        self.flush_buffer()
+        if self.compression == 'gzip':
+            self.stream.close()
+        elif self.compression == 'zstd':
+            self.stream.flush(zstandard.FLUSH_FRAME)
+        self.file.flush()
+        position = self.file.tell()
+        if self.compression == 'gzip':
+            # the header of the next member is written right away
+            self.open_stream()
+        return position
+
+    def close(self):
+        if self.stream is None:
+            return
+        self.flush_buffer()
+        if self.stream is not self.file:
+            self.stream.close()
+        if not self.file.closed:
+            self.file.close()
+        self.stream = None
+        self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,30 @@
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules of `parser/` and `miner/` are imported as scripts (e.g., `from parser import Repository`)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'miner'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'parser'))
+
+
+@pytest.fixture
+def stub_server():
+    """
+    Starts local HTTP servers answering with a `http.server.BaseHTTPRequestHandler` class, returns their base URL.
+    """
+    servers = []
+
+    def start(handler):
+        server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://localhost:{server.server_address[1]}/'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+
+from code_change_comparators import MethodComparator, PythonFileComparator
+from parser import PythonFile, parse_python_data
+
+FILE1 = '''
+class A:
+    def f(self, x):
+        return g(x)
+
+    def f(self, x):
+        return h(x)
+
+    def k(self):
+        return 1
+
+    def p(self, a):
+        return np.mean(a)
+
+
+def top(a):
+    return len(a)
+
+
+def gone():
+    pass
+'''
+
+FILE2 = '''
+class A:
+    def f(self, x):
+        return g(x) + 1
+
+    def k(self):
+        return 2
+
+    def k(self):
+        return 3
+
+    def p(self, a, b):
+        return np.mean(a) + np.mean(b)
+
+    def p(self, a, c):
+        pass
+
+
+def top(a):
+    return len(a)
+
+
+def new():
+    pass
+'''
+
+METHOD1 = '''
+def run(x, y, a):
+    f(x)
+    f(x)
+    g(y)
+    np.mean(a)
+    print(f(x))
+'''
+
+METHOD2 = '''
+def run(x, y, a, b):
+    f(x)
+    g(y)
+    f(x)
+    f(z)
+    np.mean(b)
+    log.info(x)
+'''
+
+
+def get_file(relative_path, content):
+    repository = SimpleNamespace(path='/repository')
+    record = parse_python_data((relative_path, content.encode('utf-8')))
+    return PythonFile(f'/repository/{relative_path}', repository, record)
+
+
+def get_signature(method):
+    return method if isinstance(method, str) else (method.class_name, method.name, method.params)
+
+
+def get_call(fc):
+    return fc if isinstance(fc, str) else (fc.expression, fc.start_offset)
+
+
+def test_map_methods():
+    # mapping of the nested scan over the methods of both files (before they were indexed by signature):
+    # - the second `A.f` has the signature of a matched method, it is skipped
+    # - the second `A.k` of the new file is never mapped nor added
+    # - `A.p` is mapped to the first partial match, then also reported as removed, and both `A.p` are added
+    comparator = PythonFileComparator(get_file('a.py', FILE1), get_file('a.py', FILE2))
+    assert [(get_signature(m1), get_signature(m2)) for m1, m2 in comparator.methods_mapping] == [
+        ((None, 'top', ['a']), (None, 'top', ['a'])),
+        ((None, 'gone', []), 'removed'),
+        (('A', 'f', ['self', 'x']), ('A', 'f', ['self', 'x'])),
+        (('A', 'k', ['self']), ('A', 'k', ['self'])),
+        (('A', 'p', ['self', 'a']), ('A', 'p', ['self', 'a', 'b'])),
+        (('A', 'p', ['self', 'a']), 'removed'),
+        ((None, 'new', []), 'added'),
+        (('A', 'p', ['self', 'a', 'b']), 'added'),
+        (('A', 'p', ['self', 'a', 'c']), 'added'),
+    ]
+
+
+def test_map_unchanged_file():
+    file1 = get_file('a.py', FILE2)
+    file2 = get_file('a.py', FILE2)
+    comparator = PythonFileComparator(file1, file2)
+    # the second `A.k` has the signature of a matched method
+    assert [(get_signature(m1), get_signature(m2)) for m1, m2 in comparator.methods_mapping] == [
+        ((None, 'top', ['a']), (None, 'top', ['a'])),
+        ((None, 'new', []), (None, 'new', [])),
+        (('A', 'f', ['self', 'x']), ('A', 'f', ['self', 'x'])),
+        (('A', 'k', ['self']), ('A', 'k', ['self'])),
+        (('A', 'p', ['self', 'a', 'b']), ('A', 'p', ['self', 'a', 'b'])),
+        (('A', 'p', ['self', 'a', 'c']), ('A', 'p', ['self', 'a', 'c'])),
+    ]
+
+
+def test_map_function_calls():
+    # repeated identical calls are mapped in order of their offsets, to the first unmapped call with the same
+    # context and name
+    method1 = get_file('m1.py', METHOD1).methods[0]
+    method2 = get_file('m2.py', METHOD2).methods[0]
+    comparator = MethodComparator(method1, method2)
+    assert [(get_call(fc1), get_call(fc2)) for fc1, fc2 in comparator.fc_mapping] == [
+        (('f(x)', 22), ('f(x)', 25)),
+        (('f(x)', 31), ('f(x)', 43)),
+        (('g(y)', 40), ('g(y)', 34)),
+        (('np.mean(a)', 49), ('np.mean(b)', 61)),
+        (('print(f(x))', 64), 'removed'),
+        (('f(x)', 70), ('f(z)', 52)),
+        (('log.info(x)', 76), 'added'),
+    ]
+    assert [fc['statistics']['ratio'] for fc in comparator.fc_data if 'statistics' in fc] == [
+        1.0, 1.0, 1.0, 0.9, 0.75
+    ]
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from line_diff import get_hunks, get_line_diff, get_matching_blocks
+
+
+def get_lcs_length(a, b):
+    # dynamic programming reference
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def check_blocks(a, b, blocks):
+    for a_start, b_start, length in blocks:
+        assert length > 0
+        assert a[a_start:a_start + length] == b[b_start:b_start + length]
+    # blocks are in order and do not overlap
+    for (a_start, b_start, length), (next_a_start, next_b_start, _) in zip(blocks, blocks[1:]):
+        assert a_start + length <= next_a_start and b_start + length <= next_b_start
+    assert sum(length for _, _, length in blocks) == get_lcs_length(a, b)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matching_blocks(seed):
+    # blocks of a longest common subsequence, with few (many matches) or many (few matches) distinct elements
+    rng = random.Random(seed)
+    for _ in range(300):
+        n_values = rng.choice((2, 5, 20))
+        a = [rng.randrange(n_values) for _ in range(rng.randrange(30))]
+        b = [rng.randrange(n_values) for _ in range(rng.randrange(30))]
+        check_blocks(a, b, get_matching_blocks(a, b))
+
+
+def test_unique_lines():
+    # lines on one side only are discarded before the search, the blocks still index the original lines
+    a = ['x1', 'a', 'x2', 'b', 'c', 'x3']
+    b = ['a', 'y1', 'b', 'c', 'y2', 'y3']
+    blocks = get_matching_blocks(a, b)
+    assert blocks == [(1, 0, 1), (3, 2, 2)]
+    check_blocks(a, b, blocks)
+    # a block of the discarded sequences (a, b) is split where the discarded lines were
+    assert get_matching_blocks(['a', 'x', 'b'], ['a', 'b']) == [(0, 0, 1), (2, 1, 1)]
+    # no common line: a single replace hunk
+    assert get_matching_blocks(['a', 'b'], ['c', 'd', 'e']) == []
+    assert get_hunks(['a', 'b'], ['c', 'd', 'e']) == [(0, 2, 0, 3)]
+
+
+def test_rewritten_method():
+    content1 = '\n'.join(f'x = f_{i}(y)' for i in range(3000))
+    content2 = '\n'.join(f'y = g_{i}(x)' for i in range(3000))
+    assert get_line_diff(content1, content2)['hunks'] == [
+        {'type': 'modified', 'prev_start': 0, 'prev_end': 3000, 'start': 0, 'end': 3000}
+    ]
+
+
+METHOD = 'def f(x):\n    y = x + 1\n    return y'
+
+
+@pytest.mark.parametrize('content1, content2, added_lines, removed_lines, hunks', [
+    ('', '', 0, 0, []),
+    (METHOD, METHOD, 0, 0, []),
+    # indentation changes are not reported
+    (METHOD, METHOD.replace('    ', '  '), 0, 0, []),
+    # an empty method has one empty line
+    ('', METHOD, 3, 1, [('modified', 0, 1, 0, 3)]),
+    (METHOD, '', 1, 3, [('modified', 0, 3, 0, 1)]),
+    (METHOD, 'def f(x):\n    y = x + 1\n    z = y * 2\n    w = z\n    return y', 2, 0,
+     [('added', 2, 2, 2, 4)]),
+    (METHOD, 'def f(x):\n    return y', 0, 1, [('removed', 1, 2, 1, 1)]),
+    (METHOD, 'def f(x):\n    y = x - 1\n    return y', 1, 1, [('modified', 1, 2, 1, 2)]),
+    ('def f(x):\n    a = 1\n    b = 2\n    return a', 'def f(x):\n    c = 3\n    b = 2\n    return b', 2, 2,
+     [('modified', 1, 2, 1, 2), ('modified', 3, 4, 3, 4)]),
+])
+def test_line_diff(content1, content2, added_lines, removed_lines, hunks):
+    line_diff = get_line_diff(content1, content2)
+    assert line_diff['added_lines'] == added_lines
+    assert line_diff['removed_lines'] == removed_lines
+    assert [(hunk['type'], hunk['prev_start'], hunk['prev_end'], hunk['start'], hunk['end'])
+            for hunk in line_diff['hunks']] == hunks
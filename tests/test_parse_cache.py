@@ -0,0 +1,37 @@
+import threading
+
+from parse_cache import ParseCache
+
+
+def run_in_thread(function, *args):
+    # returns the result of `function` called in a new thread, or raises its exception
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = function(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def test_threads(tmp_path):
+    # the connection of the process is shared by threads, e.g., the thread prefetching each repository
+    cache = ParseCache(str(tmp_path / 'parse_cache.sqlite'))
+    cache.put('a', {'methods': [1, 2]})
+    assert run_in_thread(cache.get, 'a') == {'methods': [1, 2]}
+    run_in_thread(cache.put, 'b', {'methods': []})
+    run_in_thread(cache.evict)
+    assert cache.get('b') == {'methods': []}
+
+    # entries are evicted from another thread
+    cache.max_size = 0
+    run_in_thread(cache.evict)
+    assert run_in_thread(cache.get, 'a') is None
+    assert cache.get('b') is None
@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+from parser import Repository
+
+PARSER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parser')
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_broken_link(tmp_path, num_workers):
+    # a broken .py link is kept without methods, whether files are parsed serially or by a pool
+    (tmp_path / 'a.py').write_text('def a():\n    pass\n')
+    os.symlink(tmp_path / 'missing.py', tmp_path / 'b.py')
+    repository = Repository(str(tmp_path), num_workers=num_workers, show_progress=False)
+    assert sorted((file.relative_path, len(file.methods)) for file in repository.files) == [('a.py', 1), ('b.py', 0)]
+
+
+def test_ids_across_processes(tmp_path):
+    # ids of the records do not depend on the hash seed of the process, so that resumed outputs map to the records
+    # written by previous runs
+    (tmp_path / 'a.py').write_text('class A:\n    def f(self, x):\n        return g(x)\n\n\ndef h():\n    return f(1)\n')
+    script = (
+        'import json, sys\n'
+        'from parser import Repository\n'
+        'file = Repository(sys.argv[1], num_workers=0, show_progress=False).files[0]\n'
+        'print(json.dumps([file.to_dict()["id"]] + [m.to_dict()["id"] for m in file.methods]\n'
+        '                 + [fc.to_dict()["id"] for m in file.methods for fc in m.function_calls]))\n'
+    )
+    ids = []
+    for seed in ('1', '2'):
+        env = {**os.environ, 'PYTHONHASHSEED': seed, 'PYTHONPATH': PARSER_DIR}
+        output = subprocess.run([sys.executable, '-c', script, str(tmp_path)], env=env, cwd=PARSER_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        ids.append(json.loads(output))
+    assert ids[0] == ids[1]
+    assert len(set(ids[0])) == 5
+
+
+def test_archive_and_extracted(tmp_path):
+    # a release read from its archive has the same files, in the same order, as the extracted release
+    files = {'setup.py': 'def setup():\n    pass\n', 'pkg/b.py': 'def b():\n    pass\n',
+             'pkg/a.py': 'def a():\n    pass\n\n\ndef c():\n    pass\n', '.github/hidden.py': 'def h():\n    pass\n'}
+    source_dir = tmp_path / 'source' / 'repo-v1'
+    for relative_path, content in files.items():
+        (source_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (source_dir / relative_path).write_text(content)
+    os.symlink('a.py', source_dir / 'pkg' / 'link.py')
+    os.symlink('missing.py', source_dir / 'pkg' / 'broken.py')
+
+    extracted_dir = tmp_path / 'extracted'
+    shutil.copytree(source_dir, extracted_dir, symlinks=True)
+    archive_dir = tmp_path / 'archive'
+    archive_dir.mkdir()
+    with tarfile.open(archive_dir / 'data.tar.gz', 'w:gz') as archive:
+        # members of some archives are prefixed with './'
+        archive.add(source_dir, arcname='./repo-v1')
+
+    releases = []
+    for path in (extracted_dir, archive_dir):
+        repository = Repository(str(path), num_workers=0, show_progress=False)
+        releases.append([(file.relative_path, len(file.methods)) for file in repository.files])
+    assert releases[0] == releases[1] == [('pkg/a.py', 2), ('pkg/b.py', 1), ('pkg/broken.py', 0), ('pkg/link.py', 2),
+                                          ('setup.py', 1)]
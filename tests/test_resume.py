@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+import manifest
+from code_change_data_generator import process_repository, read_download_data
+from synthetic_releases import generate_releases
+
+
+@pytest.fixture(scope='module')
+def repository(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('data'))
+    download_data_fp = generate_releases(data_dir, n_releases=4, n_files=5, n_methods=4, method_lines=5)
+    return read_download_data(download_data_fp)[0], data_dir
+
+
+def generate(repository, output_dir, **kwargs):
+    repo_df, data_dir = repository
+    os.makedirs(output_dir, exist_ok=True)
+    process_repository(repo_df, data_dir, str(output_dir), show_progress=False, **kwargs)
+
+
+def read_output(output_dir):
+    # content of the files of an output (records and manifest) by relative path
+    output = {}
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as file:
+                output[os.path.relpath(path, output_dir)] = file.read()
+    return output
+
+
+@pytest.mark.parametrize('output_format, compression', [
+    ('jsonl', None),
+    ('jsonl', 'gzip'),
+    ('jsonl', 'zstd'),
+    ('parquet', None)
+])
+def test_resume(tmp_path, repository, output_format, compression):
+    # a run resumed after an interruption writes the same output as a full run
+    kwargs = {'output_format': output_format, 'compression': compression}
+    generate(repository, tmp_path / 'full', **kwargs)
+    generate(repository, tmp_path / 'resumed', **kwargs)
+
+    # interrupted after the first release pairs, while writing the next one
+    manifest_path = tmp_path / 'resumed' / 'synthetic0.manifest.json'
+    data = json.loads(manifest_path.read_text())
+    data['pairs'] = data['pairs'][:2]
+    manifest_path.write_text(json.dumps(data))
+    if output_format == 'jsonl':
+        output_path = next((tmp_path / 'resumed').glob('synthetic0.jsonl*'))
+        with open(output_path, 'ab') as file:
+            file.write(b'{"partial": ')
+
+    generate(repository, tmp_path / 'resumed', **kwargs)
+    full = read_output(tmp_path / 'full')
+    assert len(full) > 1
+    assert read_output(tmp_path / 'resumed') == full
+
+
+def test_release_hashes(tmp_path, repository, monkeypatch):
+    # releases are only hashed again when their files changed
+    hashed = []
+    hash_release = manifest.hash_release
+    monkeypatch.setattr(manifest, 'hash_release', lambda *args: hashed.append(args[0]) or hash_release(*args))
+    generate(repository, tmp_path)
+    assert len(hashed) == 4
+
+    hashed.clear()
+    generate(repository, tmp_path)
+    assert hashed == []
+
+    release_dir = os.path.join(repository[1], 'synthetic0', 'v1.2.0')
+    requirements_path = os.path.join(release_dir, 'requirements.txt')
+    stat = os.stat(requirements_path)
+    os.utime(requirements_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    generate(repository, tmp_path)
+    assert hashed == [release_dir]
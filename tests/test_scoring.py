@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import Levenshtein
+import pytest
+
+import scoring
+from scoring import Scorer
+
+
+@pytest.mark.parametrize('module, value, message', [
+    ('np', None, 'missing: numpy'),
+    ('process', None, 'missing: rapidfuzz'),
+    # versions of rapidfuzz without batch scoring
+    ('process', SimpleNamespace(), 'rapidfuzz>=3.6')
+])
+def test_missing_dependencies(monkeypatch, module, value, message):
+    # scoring with several workers fails when the scorer is created, serial scoring does not need the packages
+    monkeypatch.setattr(scoring, module, value)
+    with pytest.raises(ImportError, match=message):
+        Scorer(num_workers=2)
+    assert Scorer().score('abc', 'abd') == (Levenshtein.ratio('abc', 'abd'), 1)
+
+
+def test_batch_scoring():
+    pairs = [(f'x = f({i})', f'y = f({i * 7})') for i in range(100)]
+    assert Scorer(num_workers=2, min_batch_size=1).score_pairs(pairs) == Scorer().score_pairs(pairs)
@@ -0,0 +1,81 @@
+import http.server
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from swh_utils import RequestScheduler
+
+
+def get_handler(responses):
+    # answers the (status, headers) of `responses` in order, the last one is repeated
+    requests_log = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            status, headers = responses[min(len(requests_log), len(responses) - 1)]
+            requests_log.append(time.monotonic())
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value() if callable(value) else value)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+    return requests_log, Handler
+
+
+def get_scheduler(**kwargs):
+    return RequestScheduler(requests.Session(), backoff_base=.01, **kwargs)
+
+
+@pytest.mark.parametrize('retry_after', [
+    lambda: '0.5',
+    # dates only have a resolution of a second
+    lambda: formatdate(time.time() + 2, usegmt=True)
+])
+def test_retry_after(stub_server, retry_after):
+    requests_log, handler = get_handler([(429, {'Retry-After': retry_after}), (200, {})])
+    scheduler = get_scheduler()
+    assert scheduler.request(stub_server(handler)).status_code == 200
+    assert len(requests_log) == 2
+    assert requests_log[1] - requests_log[0] >= .4
+    assert scheduler.get_metrics()['throttled'] == 1
+
+
+def test_rate_limit_exhausted(stub_server):
+    # no request is left in the rate limit window: the next requests wait for its reset
+    requests_log, handler = get_handler([
+        (200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': lambda: str(time.time() + .5)}),
+        (200, {})
+    ])
+    scheduler = get_scheduler()
+    url = stub_server(handler)
+    assert scheduler.request(url).status_code == 200
+    assert scheduler.request(url).status_code == 200
+    assert requests_log[1] - requests_log[0] >= .4
+
+
+def test_server_errors(stub_server):
+    requests_log, handler = get_handler([(503, {})])
+    scheduler = get_scheduler(max_attempts=3)
+    assert scheduler.request(stub_server(handler)) is None
+    assert len(requests_log) == 3
+    metrics = scheduler.get_metrics()
+    assert metrics['errors'] == 3
+    assert metrics['retries'] == 2
+
+
+@pytest.mark.parametrize('status', [404, 410])
+def test_not_found(stub_server, status):
+    # not found responses are not retried
+    requests_log, handler = get_handler([(status, {})])
+    scheduler = get_scheduler()
+    url = stub_server(handler)
+    assert scheduler.request(url) is None
+    assert scheduler.request(url, return_not_found=True).status_code == status
+    assert len(requests_log) == 2
@@ -0,0 +1,110 @@
+import http.server
+import json
+import re
+import time
+
+import pandas as pd
+import requests
+
+from download_repos import download_releases
+from swh_utils import RequestScheduler
+from vault_manager import VaultManager
+
+EXPIRED_ID = 'a' * 40
+OLD_ID = 'b' * 40
+NEW_ID = 'c' * 40
+# the vault fails to cook the bundles ending with 'f', and answers 503 to the first request of the bundles ending
+# with 'e'
+FAILED_ID = 'f' * 40
+ERROR_ID = 'e' * 40
+
+
+def get_vault_handler():
+    # bundles are cooked after two polls, the raw bundles of `expired` were deleted until they are cooked again
+    vault = {'posts': [], 'polls': {}, 'expired': {EXPIRED_ID}, 'errors': {ERROR_ID}}
+
+    class VaultHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, code, body=b''):
+            self.send_response(code)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def reply_status(self, directory_id, status):
+            port = self.server.server_address[1]
+            fetch_url = f'http://localhost:{port}/api/1/vault/flat/swh:1:dir:{directory_id}/raw/'
+            self.reply(200, json.dumps({'status': status, 'fetch_url': fetch_url}).encode())
+
+        def do_POST(self):
+            directory_id = re.search(r'swh:1:dir:([0-9a-f]{40})/$', self.path).group(1)
+            if directory_id in vault['errors']:
+                vault['errors'].discard(directory_id)
+                return self.reply(503)
+            vault['posts'].append(directory_id)
+            vault['expired'].discard(directory_id)
+            vault['polls'][directory_id] = 0
+            self.reply_status(directory_id, 'failed' if directory_id.endswith('f') else 'new')
+
+        def do_GET(self):
+            directory_id, raw = re.search(r'swh:1:dir:([0-9a-f]{40})/(raw/)?$', self.path).groups()
+            if raw:
+                return self.reply(410) if directory_id in vault['expired'] else self.reply(200, directory_id.encode())
+            if directory_id not in vault['polls']:
+                return self.reply(404)
+            vault['polls'][directory_id] += 1
+            self.reply_status(directory_id, 'done' if vault['polls'][directory_id] >= 2 else 'pending')
+
+    return vault, VaultHandler
+
+
+def get_manager(url, state_path, **kwargs):
+    scheduler = RequestScheduler(requests.Session(), max_attempts=1, backoff_base=0.)
+    return VaultManager(scheduler, state_path, api_url=f'{url}api/1/', poll_interval=.01, **kwargs)
+
+
+def test_expired_bundles(tmp_path, stub_server):
+    vault, handler = get_vault_handler()
+    url = stub_server(handler)
+    # a previous run cooked a bundle that the vault deleted since, and a bundle older than the retention period
+    manager = get_manager(url, str(tmp_path / 'vault_state.sqlite'))
+    for directory_id in (EXPIRED_ID, OLD_ID):
+        manager.save_state(directory_id, 'done', f'{manager.get_bundle_url(directory_id)}raw/')
+    manager.connection.execute('UPDATE bundles SET updated_at = ? WHERE directory_id = ?',
+                               (time.time() - 30 * 24 * 3600, OLD_ID))
+
+    data = pd.DataFrame([{'repository': f'https://github.com/owner/{directory_id[0]}', 'branch': 'v1',
+                          'download_link': f'{url}api/1/vault/flat/swh:1:dir:{directory_id}/'}
+                         for directory_id in (EXPIRED_ID, OLD_ID, NEW_ID)])
+    download_releases(data, str(tmp_path), 'token', num_workers=2,
+                      vault_kwargs={'api_url': f'{url}api/1/', 'poll_interval': .01})
+    assert sorted(vault['posts']) == [EXPIRED_ID, OLD_ID, NEW_ID]
+    for directory_id in (EXPIRED_ID, OLD_ID, NEW_ID):
+        assert (tmp_path / directory_id[0] / 'v1' / 'data.tar.gz').read_bytes() == directory_id.encode()
+
+
+def test_failed_cooking(tmp_path, stub_server):
+    vault, handler = get_vault_handler()
+    url = stub_server(handler)
+    state_path = str(tmp_path / 'vault_state.sqlite')
+    assert list(get_manager(url, state_path).iter_ready([FAILED_ID])) == []
+    assert get_manager(url, state_path).get_state()[FAILED_ID][0] == 'failed'
+    # the next runs only submit the bundle again with `retry_failed`
+    assert list(get_manager(url, state_path).iter_ready([FAILED_ID])) == []
+    assert vault['posts'] == [FAILED_ID]
+    assert list(get_manager(url, state_path, retry_failed=True).iter_ready([FAILED_ID])) == []
+    assert vault['posts'] == [FAILED_ID, FAILED_ID]
+
+
+def test_transient_errors(tmp_path, stub_server):
+    vault, handler = get_vault_handler()
+    url = stub_server(handler)
+    state_path = str(tmp_path / 'vault_state.sqlite')
+    # a request error is not a cooking failure: the next run submits the bundle again
+    assert list(get_manager(url, state_path).iter_ready([ERROR_ID])) == []
+    assert get_manager(url, state_path).get_state()[ERROR_ID][0] == 'error'
+    ready = list(get_manager(url, state_path).iter_ready([ERROR_ID]))
+    assert [directory_id for directory_id, _ in ready] == [ERROR_ID]
+    assert vault['posts'] == [ERROR_ID]